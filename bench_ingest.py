@@ -0,0 +1,96 @@
+# bench_ingest.py
+"""
+Бенчмарк приёма апдейтов: сколько апдейтов в секунду на одно ядро тянет разбор вебхука.
+
+  python bench_ingest.py [кол-во апдейтов]
+
+Сравниваются:
+  baseline — json.loads + types.Update.model_validate для каждого апдейта (старый путь);
+  fast     — ingest.loads + FastPath.classify, model_validate только для FULL.
+Оба валидируют с context={"bot": ...}, как перед dp.feed_update: без контекста
+диспетчер собрал бы апдейт повторно, и эта работа выпала бы из замера.
+Смесь апдейтов похожа на всплеск после выхода видео: в основном неверные коды.
+Диспетчер и БД не участвуют — меряется только CPU на приём.
+"""
+from __future__ import annotations
+
+import json
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("BOT_TOKEN", "42:bench-token")
+
+from aiogram import Bot, types
+
+import config
+import ingest
+
+MIX = (("miss", 0.70), ("code", 0.10), ("callback", 0.10), ("edited", 0.10))
+
+
+def _message(update_id: int, text: str) -> dict:
+    uid = random.randint(1, 10**9)
+    return {
+        "message_id": update_id,
+        "from": {"id": uid, "is_bot": False, "first_name": "Bench", "username": f"u{uid}", "language_code": "ru"},
+        "chat": {"id": uid, "type": "private", "first_name": "Bench", "username": f"u{uid}"},
+        "date": int(time.time()),
+        "text": text,
+    }
+
+
+def make_payloads(n: int) -> list[bytes]:
+    kinds = [k for k, _ in MIX]
+    weights = [w for _, w in MIX]
+    out = []
+    for i in range(n):
+        kind = random.choices(kinds, weights)[0]
+        if kind == "miss":
+            upd = {"update_id": i, "message": _message(i, f"guess{random.randint(0, 99999)}")}
+        elif kind == "code":
+            upd = {"update_id": i, "message": _message(i, random.choice(config.VALID_CODES))}
+        elif kind == "callback":
+            m = _message(i, "Выбери, какие уведомления получать:")
+            upd = {"update_id": i, "callback_query": {"id": str(i), "from": m["from"], "message": m,
+                                                      "chat_instance": "1", "data": "prefs:toggle:notify_streams"}}
+        else:
+            upd = {"update_id": i, "edited_message": _message(i, "edited")}
+        out.append(json.dumps(upd).encode("utf-8"))
+    return out
+
+
+def bench_baseline(payloads: list[bytes], bot: Bot) -> float:
+    t0 = time.process_time()
+    for raw in payloads:
+        types.Update.model_validate(json.loads(raw), context={"bot": bot})
+    return time.process_time() - t0
+
+
+def bench_fast(payloads: list[bytes], fast_path: ingest.FastPath, bot: Bot) -> float:
+    t0 = time.process_time()
+    for raw in payloads:
+        data = ingest.loads(raw)
+        verdict, _ = fast_path.classify(data)
+        if verdict == ingest.FULL:
+            types.Update.model_validate(data, context={"bot": bot})
+    return time.process_time() - t0
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    random.seed(1)
+    payloads = make_payloads(n)
+    fast_path = ingest.FastPath(["message", "callback_query"], config.VALID_CODES)
+    bot = Bot(os.environ["BOT_TOKEN"])  # сеть не нужна — только контекст валидации
+    bench_baseline(payloads[:1000], bot)  # прогрев
+    base = bench_baseline(payloads, bot)
+    fast = bench_fast(payloads, fast_path, bot)
+    print(f"updates: {n}, json: {'orjson' if ingest.orjson else 'json'}")
+    print(f"baseline: {n / base:10.0f} upd/s/core  ({base * 1e6 / n:.1f} µs/upd)")
+    print(f"fast    : {n / fast:10.0f} upd/s/core  ({fast * 1e6 / n:.1f} µs/upd)  x{base / fast:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# bench_polling.py
+"""
+Бенчмарк обработки апдейтов против фейкового Bot API: polling и вебхук на одном пуле воркеров.
+
+  python bench_polling.py [polling|webhook|both] [кол-во апдейтов] [задержка API, мс]
+
+Фейковый Bot API поднимается локально (бот ходит в него через TELEGRAM_API_BASE):
+getUpdates раздаёт заготовленные апдейты, sendMessage/answerCallbackQuery отвечают
+с заданной задержкой — как настоящий Telegram по сети. Латентность — от выдачи апдейта
+(getUpdates или POST в вебхук) до ответа бота на него.
+Смесь: неверные коды и нажатия кнопок от ограниченного числа пользователей — хэндлеры
+без БД, меряется приём, диспетчер и конкурентность.
+Бот стартует и останавливается своими хуками (_run_polling, on_startup/on_shutdown вебхука);
+БД нет — адрес указывает в закрытый порт, журнал и кэш выгрузки во временном каталоге.
+"""
+from __future__ import annotations
+
+import asyncio
+import atexit
+import logging
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+API_PORT = _free_port()
+os.environ.setdefault("BOT_TOKEN", "42:bench-token")
+os.environ["TELEGRAM_API_BASE"] = f"http://127.0.0.1:{API_PORT}"
+os.environ["WEBHOOK_FAST_PATH"] = "0"       # неверные коды тоже через диспетчер — сравниваем одинаковую работу
+os.environ["THROTTLE_CODE_MISS"] = "1000000/1"
+os.environ.setdefault("LOG_LEVEL", "ERROR")  # без предупреждений о недоступной БД
+os.environ["DATABASE_URL"] = f"postgresql://bench@127.0.0.1:{_free_port()}/bench"
+os.environ["DB_OPEN_TIMEOUT"] = "0.5"
+_TMP = tempfile.mkdtemp(prefix="bench_polling_")
+atexit.register(shutil.rmtree, _TMP, True)
+os.environ["ENTRY_JOURNAL_PATH"] = os.path.join(_TMP, "entries.journal")
+os.environ["EXPORT_CACHE_DIR"] = os.path.join(_TMP, "exports")
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import bot as app_bot
+
+logging.getLogger("psycopg").setLevel(logging.ERROR)  # psycopg сам ставит WARNING — попытки пула к закрытому порту
+
+USERS = 2000
+
+
+class FakeBotAPI:
+    def __init__(self, updates: list[dict], delay: float) -> None:
+        self.pending = list(updates)
+        self.delay = delay
+        self.issued: dict[str, float] = {}   # ключ ответа -> когда апдейт ушёл боту
+        self.latencies: list[float] = []
+        self.done = asyncio.Event()
+        self.total = len(updates)
+        self.first_issued = 0.0  # пропускная способность — от первой выдачи до последнего ответа, без старта бота
+        self.finished = 0.0
+
+    @staticmethod
+    def reply_key(update: dict) -> str:
+        if "callback_query" in update:
+            return "cb:" + update["callback_query"]["id"]
+        return f"chat:{update['message']['chat']['id']}"
+
+    def mark_issued(self, update: dict) -> None:
+        now = time.perf_counter()
+        self.first_issued = self.first_issued or now
+        self.issued[self.reply_key(update)] = now
+
+    def _answered(self, key: str) -> None:
+        t0 = self.issued.pop(key, None)
+        if t0 is not None:
+            self.latencies.append(time.perf_counter() - t0)
+            if len(self.latencies) >= self.total:
+                self.finished = time.perf_counter()
+                self.done.set()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        form = await request.post()
+        if method == "getupdates":
+            offset = int(form.get("offset") or 0)
+            limit = int(form.get("limit") or 100)
+            self.pending = [u for u in self.pending if u["update_id"] >= offset]
+            batch = self.pending[:limit]
+            if not batch:
+                await asyncio.sleep(0.05)
+            for u in batch:
+                if self.reply_key(u) not in self.issued:
+                    self.mark_issued(u)
+            return web.json_response({"ok": True, "result": batch})
+        await asyncio.sleep(self.delay)
+        if method == "sendmessage":
+            chat_id = int(form["chat_id"])
+            self._answered(f"chat:{chat_id}")
+            return web.json_response({"ok": True, "result": {
+                "message_id": 1, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"},
+                "text": form.get("text", "")}})
+        if method == "answercallbackquery":
+            self._answered("cb:" + form["callback_query_id"])
+        return web.json_response({"ok": True, "result": True})
+
+
+def make_updates(n: int) -> list[dict]:
+    out = []
+    for i in range(1, n + 1):
+        uid = random.randint(1, USERS)
+        user = {"id": uid, "is_bot": False, "first_name": "Bench"}
+        # chat.id уникален на апдейт — так ответ однозначно сопоставляется с апдейтом
+        msg = {"message_id": i, "from": user, "chat": {"id": 10**9 + i, "type": "private"},
+               "date": int(time.time()), "text": f"guess{i}"}
+        if random.random() < 0.2:
+            out.append({"update_id": i, "callback_query": {"id": str(i), "from": user, "message": msg,
+                                                           "chat_instance": "1", "data": "bench:noop"}})
+        else:
+            out.append({"update_id": i, "message": msg})
+    return out
+
+
+async def run(mode: str, n: int, delay: float) -> None:
+    random.seed(1)
+    updates = make_updates(n)
+    api = FakeBotAPI(updates, delay)
+    api_app = web.Application()
+    api_app.router.add_post("/bot{token}/{method}", api.handle)
+    runner = web.AppRunner(api_app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", API_PORT).start()
+
+    if mode == "polling":
+        poller = asyncio.create_task(app_bot._run_polling())
+        await api.done.wait()
+        poller.cancel()  # _run_polling сам останавливает сервисы и закрывает сессии
+        await asyncio.gather(poller, return_exceptions=True)
+    else:
+        # TestServer проходит on_startup/on_shutdown приложения, как web.run_app
+        async with TestClient(TestServer(app_bot.create_app())) as client:
+            headers = {"X-Telegram-Bot-Api-Secret-Token": app_bot.WEBHOOK_SECRET}
+            sem = asyncio.Semaphore(100)  # столько соединений держит Telegram (max_connections)
+
+            async def post(u: dict) -> None:
+                async with sem:
+                    api.mark_issued(u)
+                    await client.post(app_bot.WEBHOOK_PATH, json=u, headers=headers)
+
+            await asyncio.gather(*(post(u) for u in updates))
+            await api.done.wait()
+    await runner.cleanup()
+    elapsed = api.finished - api.first_issued
+
+    lat = sorted(api.latencies)
+    p = lambda q: lat[min(len(lat) - 1, int(q * len(lat)))] * 1000
+    print(f"{mode:8}: {n / elapsed:8.0f} upd/s  p50 {p(0.5):6.1f} ms  p99 {p(0.99):6.1f} ms  "
+          f"(воркеров {app_bot.WORKERS.shards}, задержка API {delay * 1000:.0f} мс)")
+
+
+def main() -> None:
+    mode = sys.argv[1] if len(sys.argv) > 1 else "both"
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    delay = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.02
+    if mode == "both":
+        # каждый режим — в своём процессе: журнал, кэш и воркеры привязаны к event loop первого запуска
+        for m in ("polling", "webhook"):
+            subprocess.run([sys.executable, __file__, m, str(n), str(delay * 1000)], check=True)
+        return
+    asyncio.run(run(mode, n, delay))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,14 +3,17 @@ from __future__ import annotations
 import os
 import sys
 import asyncio
-import csv
 import datetime as dt
+import functools
+import html
 import logging
 import random
 import secrets
-from io import StringIO
+import signal
 from collections import defaultdict
+from contextlib import AsyncExitStack, asynccontextmanager
 import socket
+import time
 from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
 from typing import Dict, List
 
@@ -20,7 +23,9 @@ if sys.platform.startswith("win"):
 
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.client.default import DefaultBotProperties
-from aiogram.filters import Command
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import Command, CommandObject
 from aiogram.types import (
     BotCommand,
     BufferedInputFile,
@@ -38,21 +43,63 @@ from aiogram.fsm.storage.memory import MemoryStorage
 from aiohttp import web
 from aiogram.webhook.aiohttp_server import setup_application
 
+import psycopg
+from psycopg import sql
 from psycopg_pool import AsyncConnectionPool
 from psycopg.rows import tuple_row
 
 import config
+import ingest
+import logs
+import profiler
+import workers
+from exports import CsvExportCache, rows_to_csv, write_gzip
+from journal import EntryJournal
+from throttling import Budget, Throttler, ThrottlingMiddleware
+from tenants import (
+    DEFAULT_SLUG, Tenant, TenantMiddleware, TenantRegistry, current_tenant, is_valid_campaign, load_specs, lower_codes,
+)
+from tracing import Tracer, TracingRequestMiddleware, TracingUpdateMiddleware, exporter_from_spec
 
 # ---------- ЛОГИ ----------
-logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+# частые строки: сэмплируем и ограничиваем, чтобы не забивать очередь логов под нагрузкой
+_HOT_LOG_LINES = (
+    "/start from user_id=%s",
+    "/my from user_id=%s",
+    "/top from user_id=%s",
+    "/prefs from user_id=%s",
+    "prefs toggle %s by user_id=%s",
+    "UNHANDLED callback: data=%s from user_id=%s",
+    "get_chat_member username fail: %s",
+    "get_chat_member id fail: %s",
+    "Update id=%s is %s. Duration %d ms by bot id=%d",  # aiogram.event, на каждый апдейт
+)
+LOG_SAMPLING = logs.setup_logging(
+    config.LOG_LEVEL, config.LOG_FORMAT,
+    rules={line: logs.LogRule(sample=config.LOG_HOT_SAMPLE, per_sec=config.LOG_HOT_PER_SEC) for line in _HOT_LOG_LINES},
+)
 logger = logging.getLogger("prizes-bot")
 
+# ---------- ТРЕЙСИНГ ----------
+TRACER = Tracer(exporter_from_spec(config.TRACE_EXPORT), sample_rate=config.TRACE_SAMPLE_RATE,
+                max_traces_per_sec=config.TRACE_MAX_PER_SEC)
+
 # ---------- БОТ/DP ----------
 dp = Dispatcher(storage=MemoryStorage())
-bot = Bot(
-    token=config.BOT_TOKEN,
-    default=DefaultBotProperties(parse_mode="HTML", link_preview_is_disabled=True),
-)
+
+
+def _make_bot(token: str) -> Bot:
+    session = AiohttpSession(api=TelegramAPIServer.from_base(config.TELEGRAM_API_BASE)) \
+        if config.TELEGRAM_API_BASE else None
+    b = Bot(token=token, session=session,
+            default=DefaultBotProperties(parse_mode="HTML", link_preview_is_disabled=True))
+    b.session.middleware(TracingRequestMiddleware(TRACER))
+    return b
+
+
+bot = _make_bot(config.BOT_TOKEN)
+
+VALID_CODES_LC = lower_codes(config.VALID_CODES)
 
 PART_LEN = config.PARTICIPANT_CODE_LEN
 ALPHABET = config.PARTICIPANT_CODE_ALPHABET
@@ -60,7 +107,50 @@ ALPHABET = config.PARTICIPANT_CODE_ALPHABET
 REQ_CH_USERNAME = (os.getenv("REQUIRED_CHANNEL_USERNAME") or "projectglml").lstrip("@")
 REQ_CH_ID = int(os.getenv("REQUIRED_CHANNEL_ID") or "-1000000000000")  # ОБЯЗАТЕЛЬНО выстави реальный ID канала
 
+# ---------- ТЕНАНТЫ ----------
+# тенант 'default' — бот из ENV; остальные — из TENANTS_FILE, на общем пуле и общем dp
+TENANTS = TenantRegistry()
+DEFAULT_TENANT = Tenant(slug=DEFAULT_SLUG, bot=bot, channel_username=REQ_CH_USERNAME, channel_id=REQ_CH_ID,
+                        valid_codes=VALID_CODES_LC, admin_ids=frozenset(config.ADMIN_IDS), campaign=config.CAMPAIGN)
+TENANTS.add(DEFAULT_TENANT)
+for _spec in load_specs(config.TENANTS_FILE):
+    TENANTS.add(Tenant(
+        slug=_spec["slug"],
+        bot=_make_bot(_spec["bot_token"]),
+        channel_username=(_spec.get("channel_username") or "").lstrip("@"),
+        channel_id=int(_spec.get("channel_id") or 0),
+        valid_codes=lower_codes(_spec["codes"]),
+        admin_ids=frozenset(int(x) for x in _spec.get("admin_ids") or []) | DEFAULT_TENANT.admin_ids,
+        webhook_secret=_spec.get("webhook_secret") or "",
+        title=_spec.get("title") or DEFAULT_TENANT.title,
+        campaign=(_spec.get("campaign") or config.CAMPAIGN).strip().lower(),
+    ))
+
+
+def tenant() -> Tenant:
+    """Тенант текущего апдейта (вне апдейта — тенант по умолчанию)."""
+    return current_tenant.get() or DEFAULT_TENANT
+
+
+dp.update.outer_middleware(TenantMiddleware(TENANTS))
+dp.update.outer_middleware(TracingUpdateMiddleware(TRACER))
+dp.update.outer_middleware(logs.LogContextMiddleware())
+
 POOL: AsyncConnectionPool | None = None
+_SCHEMA_READY = False
+# подключение и проверка схемы — строго по одному (иначе параллельные вызовы плодят пулы и миграции)
+_DB_LOCK = asyncio.Lock()
+_DB_FAILURES = 0  # неудачных connect_db: ждавшие замка не повторяют только что неудавшуюся попытку
+# False — регистрации сразу идут в журнал; обратно включают только старт и _journal_replayer
+_DB_HEALTHY = False
+
+# Пул обработки апдейтов: общий для вебхука и polling, порядок — в пределах пользователя
+# длительности заданий уходят в /profile: апдейты в воркерах не создаются отдельными задачами
+WORKERS = workers.ShardedWorkers(config.WORKER_SHARDS, config.WORKER_QUEUE, on_done=profiler.record)
+
+# Локальный журнал регистраций на время недоступности/перегрузки БД
+JOURNAL = EntryJournal(config.ENTRY_JOURNAL_PATH)
+_replayer_task: asyncio.Task | None = None
 
 # ---------- УТИЛИТЫ ----------
 def make_participant_code() -> str:
@@ -68,7 +158,7 @@ def make_participant_code() -> str:
 
 
 def is_admin(user_id: int) -> bool:
-    return user_id in set(getattr(config, "ADMIN_IDS", []) or [])
+    return user_id in tenant().admin_ids
 
 
 INIT_SQL = """
@@ -79,25 +169,238 @@ create table if not exists public.users (
     participant_code text unique not null
 );
 
+-- всё, что ниже, разделено по тенантам (tenant_id); users — общие для всех ботов
+-- entries секционирована по кампании: секция public.entries_c_<campaign>, см. ENTRIES_MIGRATION
+create sequence if not exists public.entries_id_seq;
 create table if not exists public.entries (
-    id bigserial primary key,
+    id bigint not null default nextval('public.entries_id_seq'),
+    tenant_id text not null default 'default',
+    campaign text not null default 'main',
     user_id bigint not null references public.users(user_id) on delete cascade,
     username text,
     first_name text,
     code text not null,
     entry_number int not null,
     created_at timestamp not null default now()
-);
-create unique index if not exists idx_entries_user_code on public.entries(user_id, code);
+) partition by list (campaign);
 
 create table if not exists public.user_prefs (
-    user_id bigint primary key references public.users(user_id) on delete cascade,
+    tenant_id text not null default 'default',
+    user_id bigint not null references public.users(user_id) on delete cascade,
     notify_results boolean not null default true,
     notify_new_video boolean not null default true,
     notify_streams boolean not null default true,
     created_at timestamp not null default now(),
-    updated_at timestamp not null default now()
+    updated_at timestamp not null default now(),
+    primary key (tenant_id, user_id)
+);
+
+-- почасовые агрегаты для статистики (обновляются при вставке заявки), по кампаниям
+create table if not exists public.stats_hourly (
+    tenant_id text not null default 'default',
+    campaign text not null default 'main',
+    hour timestamp not null,
+    entries int not null default 0,
+    new_users int not null default 0,
+    primary key (tenant_id, campaign, hour)
+);
+create table if not exists public.stats_hourly_codes (
+    tenant_id text not null default 'default',
+    campaign text not null default 'main',
+    hour timestamp not null,
+    code text not null,
+    entries int not null default 0,
+    primary key (tenant_id, campaign, hour, code)
+);
+
+-- рейтинг кампании: сколько разных кодов у участника; score_buckets — сколько участников с каждым счётом,
+-- место = 1 + сумма по бакетам с большим счётом (бакетов не больше, чем кодов)
+create table if not exists public.user_scores (
+    tenant_id text not null default 'default',
+    campaign text not null default 'main',
+    user_id bigint not null references public.users(user_id) on delete cascade,
+    codes_count int not null,
+    reached_at timestamp not null,
+    primary key (tenant_id, campaign, user_id)
+);
+create table if not exists public.score_buckets (
+    tenant_id text not null default 'default',
+    campaign text not null default 'main',
+    codes_count int not null,
+    users int not null,
+    primary key (tenant_id, campaign, codes_count)
+);
+
+-- до какой заявки админ уже выгружал «новые» (инкрементальный экспорт)
+create table if not exists public.export_watermarks (
+    tenant_id text not null default 'default',
+    admin_id bigint not null,
+    last_entry_id bigint not null default 0,
+    updated_at timestamp not null default now(),
+    primary key (tenant_id, admin_id)
 );
+
+-- миграция таблиц, созданных до мульти-тенантности: старые данные — тенант 'default'
+do $$
+declare t record;
+begin
+    for t in select * from (values
+        ('entries', null),
+        ('user_prefs', 'tenant_id, user_id'),
+        ('stats_hourly', 'tenant_id, hour'),
+        ('stats_hourly_codes', 'tenant_id, hour, code'),
+        ('user_scores', 'tenant_id, user_id'),
+        ('score_buckets', 'tenant_id, codes_count'),
+        ('export_watermarks', 'tenant_id, admin_id')
+    ) as v(tbl, pk) loop
+        if not exists (select 1 from information_schema.columns
+                        where table_schema = 'public' and table_name = t.tbl and column_name = 'tenant_id') then
+            execute format('alter table public.%I add column tenant_id text not null default %L', t.tbl, 'default');
+            if t.pk is not null then
+                execute format('alter table public.%I drop constraint %I', t.tbl, t.tbl || '_pkey');
+                execute format('alter table public.%I add primary key (%s)', t.tbl, t.pk);
+            end if;
+        end if;
+    end loop;
+end $$;
+
+-- агрегаты, созданные до кампаний: всё накопленное относится к кампании 'main' (как и старые заявки)
+do $$
+declare t record;
+begin
+    for t in select * from (values
+        ('stats_hourly', 'tenant_id, campaign, hour'),
+        ('stats_hourly_codes', 'tenant_id, campaign, hour, code'),
+        ('user_scores', 'tenant_id, campaign, user_id'),
+        ('score_buckets', 'tenant_id, campaign, codes_count')
+    ) as v(tbl, pk) loop
+        if not exists (select 1 from information_schema.columns
+                        where table_schema = 'public' and table_name = t.tbl and column_name = 'campaign') then
+            execute format('alter table public.%I add column campaign text not null default %L', t.tbl, 'main');
+            execute format('alter table public.%I drop constraint %I', t.tbl, t.tbl || '_pkey');
+            execute format('alter table public.%I add primary key (%s)', t.tbl, t.pk);
+        end if;
+    end loop;
+end $$;
+
+create index if not exists idx_user_scores_campaign_rank
+    on public.user_scores(tenant_id, campaign, codes_count desc, reached_at, user_id);
+drop index if exists public.idx_user_scores_tenant_rank;
+drop index if exists public.idx_user_scores_rank;
+"""
+
+
+# первичное заполнение агрегатов из entries (только если их ещё нет); идёт после
+# секционирования entries — до него у старой таблицы нет колонки campaign.
+# Новый участник кампании = его первая заявка в ней (минимальный id)
+BACKFILL_SQL = """
+insert into public.stats_hourly(tenant_id, campaign, hour, entries, new_users)
+select e.tenant_id, e.campaign, date_trunc('hour', e.created_at), count(*), count(*) filter (where e.id = f.first_id)
+  from public.entries e
+  join (select tenant_id, campaign, user_id, min(id) as first_id from public.entries
+         group by tenant_id, campaign, user_id) f
+    using (tenant_id, campaign, user_id)
+ where not exists (select 1 from public.stats_hourly)
+ group by 1, 2, 3;
+insert into public.stats_hourly_codes(tenant_id, campaign, hour, code, entries)
+select tenant_id, campaign, date_trunc('hour', created_at), code, count(*)
+  from public.entries
+ where not exists (select 1 from public.stats_hourly_codes)
+ group by 1, 2, 3, 4;
+insert into public.user_scores(tenant_id, campaign, user_id, codes_count, reached_at)
+select tenant_id, campaign, user_id, count(distinct code), max(created_at)
+  from public.entries
+ where not exists (select 1 from public.user_scores)
+ group by tenant_id, campaign, user_id;
+insert into public.score_buckets(tenant_id, campaign, codes_count, users)
+select tenant_id, campaign, codes_count, count(*)
+  from public.user_scores
+ where not exists (select 1 from public.score_buckets)
+ group by tenant_id, campaign, codes_count;
+"""
+
+
+# индексы entries; на секционированной таблице каждый уникальный ключ обязан включать campaign
+ENTRIES_INDEX_SQL = """
+create unique index if not exists idx_entries_id on public.entries(id, campaign);
+create unique index if not exists idx_entries_tenant_campaign_user_code
+    on public.entries(tenant_id, campaign, user_id, code);
+create index if not exists idx_entries_tenant_campaign_number on public.entries(tenant_id, campaign, entry_number);
+"""
+
+# кампания, в которую попадают заявки, созданные до секционирования entries
+LEGACY_CAMPAIGN = "main"
+# pg_advisory_lock на проверку схемы и миграцию: несколько экземпляров бота не мигрируют разом
+SCHEMA_LOCK_KEY = 0x7072697A_0001
+# вставка заявки держит его разделяемо до коммита, выгрузка берёт монопольно — см. _entries_horizon
+ENTRIES_LOCK_KEY = 0x7072697A_0002
+
+# Перевод старой (обычной) entries в секционированную без остановки записи:
+# тяжёлые шаги — индексы CONCURRENTLY и VALIDATE CONSTRAINT — не блокируют вставки,
+# каждый идёт отдельной транзакцией. Затем короткая транзакция: старая таблица
+# переименовывается в секцию entries_c_main, над ней создаётся секционированная entries,
+# и секция цепляется без сканирования (готовые индексы переиспользуются, CHECK уже проверен).
+ENTRIES_MIGRATION_PREPARE = (
+    # новая колонка с константным DEFAULT — только метаданные, без перезаписи таблицы
+    f"alter table public.entries add column if not exists campaign text not null default '{LEGACY_CAMPAIGN}'",
+    "create unique index concurrently if not exists entries_c_main_id on public.entries(id, campaign)",
+    "create unique index concurrently if not exists entries_c_main_tenant_campaign_user_code "
+    "on public.entries(tenant_id, campaign, user_id, code)",
+    "create index concurrently if not exists entries_c_main_tenant_campaign_number "
+    "on public.entries(tenant_id, campaign, entry_number)",
+    "alter table public.entries drop constraint if exists entries_c_main_campaign",
+    f"alter table public.entries add constraint entries_c_main_campaign check (campaign = '{LEGACY_CAMPAIGN}') not valid",
+    "alter table public.entries validate constraint entries_c_main_campaign",
+)
+ENTRIES_MIGRATION_SWAP = f"""
+alter table public.entries rename to entries_c_main;
+create table public.entries (like public.entries_c_main including defaults) partition by list (campaign);
+alter table public.entries add foreign key (user_id) references public.users(user_id) on delete cascade;
+{ENTRIES_INDEX_SQL}
+alter sequence public.entries_id_seq owned by public.entries.id;
+alter table public.entries attach partition public.entries_c_main for values in ('{LEGACY_CAMPAIGN}');
+alter table public.entries_c_main drop constraint entries_c_main_campaign;
+"""
+ENTRIES_MIGRATION_CLEANUP = (
+    # старые индексы без campaign остались только на секции entries_c_main; их уникальность
+    # уже держит entries_c_main_tenant_campaign_user_code
+    "drop index concurrently if exists public.idx_entries_user_code",
+    "drop index concurrently if exists public.idx_entries_tenant_user_code",
+    "drop index concurrently if exists public.idx_entries_tenant_number",
+)
+
+
+# одна вставка заявки = +1 в час и +1 в час×код, одним запросом
+ROLLUP_SQL = """
+with h as (
+    insert into public.stats_hourly(tenant_id, campaign, hour, entries, new_users)
+    values (%(tenant_id)s, %(campaign)s, date_trunc('hour', %(ts)s::timestamp), 1, %(new_user)s)
+    on conflict (tenant_id, campaign, hour) do update
+        set entries = stats_hourly.entries + 1,
+            new_users = stats_hourly.new_users + excluded.new_users
+)
+insert into public.stats_hourly_codes(tenant_id, campaign, hour, code, entries)
+values (%(tenant_id)s, %(campaign)s, date_trunc('hour', %(ts)s::timestamp), %(code)s, 1)
+on conflict (tenant_id, campaign, hour, code) do update set entries = stats_hourly_codes.entries + 1
+"""
+
+
+# новый код участника в кампании: +1 к его счёту и перенос из бакета (n-1) в бакет n
+SCORE_SQL = """
+with s as (
+    insert into public.user_scores(tenant_id, campaign, user_id, codes_count, reached_at)
+    values (%(tenant_id)s, %(campaign)s, %(user_id)s, 1, %(ts)s)
+    on conflict (tenant_id, campaign, user_id) do update
+        set codes_count = user_scores.codes_count + 1,
+            reached_at = excluded.reached_at
+    returning codes_count
+), dec as (
+    update public.score_buckets b set users = b.users - 1
+      from s where b.tenant_id = %(tenant_id)s and b.campaign = %(campaign)s and b.codes_count = s.codes_count - 1
+)
+insert into public.score_buckets(tenant_id, campaign, codes_count, users)
+select %(tenant_id)s, %(campaign)s, codes_count, 1 from s
+on conflict (tenant_id, campaign, codes_count) do update set users = score_buckets.users + 1
 """
 
 
@@ -155,40 +458,146 @@ def _get_dsn() -> str:
     return final
 
 
+class _TracingCursor(psycopg.AsyncCursor):
+    """Спан на каждый SQL-запрос (conn.execute тоже идёт через cursor_factory)."""
+
+    async def execute(self, query, params=None, **kwargs):
+        with TRACER.span("db.sql", statement=str(query)[:200]):
+            return await super().execute(query, params, **kwargs)
+
+
+@asynccontextmanager
+async def _db_conn():
+    async with AsyncExitStack() as stack:
+        with TRACER.span("db.acquire"):
+            conn = await stack.enter_async_context(POOL.connection())  # type: ignore[union-attr]
+        yield conn
+
+
 async def init_db() -> None:
-    global POOL
+    """
+    Проверка перед запросом: пул поднят и схема готова, иначе сразу OperationalError.
+    Сам не подключается — это делает connect_db (старт и _journal_replayer).
+    """
+    if POOL is None or not _SCHEMA_READY:
+        raise psycopg.OperationalError("БД не подключена")
+
+
+@TRACER.traced("db.connect_db")
+async def connect_db() -> None:
+    """Поднять пул и проверить схему; параллельные вызовы ждут первый под _DB_LOCK."""
+    global POOL, _SCHEMA_READY, _DB_FAILURES
+    seen = _DB_FAILURES
+    async with _DB_LOCK:
+        if POOL is not None and _SCHEMA_READY:
+            return
+        if _DB_FAILURES != seen:
+            raise psycopg.OperationalError("БД недоступна: подключение только что не удалось")
+        try:
+            await _connect_db_locked()
+        except BaseException:
+            _DB_FAILURES += 1
+            raise
+
+
+async def _connect_db_locked() -> None:
+    global POOL, _SCHEMA_READY
     if POOL is None:
-        POOL = AsyncConnectionPool(conninfo=_get_dsn(), max_size=8, kwargs={"autocommit": True}, timeout=30)
-        await POOL.open(wait=True)
+        dsn = await asyncio.to_thread(_get_dsn)  # getaddrinfo — не на event loop
+        pool = AsyncConnectionPool(conninfo=dsn, max_size=8, timeout=30, open=False,
+                                   kwargs={"autocommit": True, "cursor_factory": _TracingCursor})
+        try:
+            await pool.open(wait=True, timeout=config.DB_OPEN_TIMEOUT)
+        except BaseException:
+            # неудачный open закрывает пул — не сохраняем его, следующий вызов создаст новый
+            await pool.close()
+            raise
+        POOL = pool
+    if _SCHEMA_READY:
+        return
+    # схема проверяется один раз за процесс (старт или первое переподключение _journal_replayer),
+    # обработчики её не трогают; при падении БД повторим при следующем подключении.
+    # Блокировка сессионная: CONCURRENTLY-шаги миграции не идут внутри транзакции
     async with POOL.connection() as conn:
-        await conn.execute(INIT_SQL)
+        await conn.execute("select pg_advisory_lock(%s)", (SCHEMA_LOCK_KEY,))
+        try:
+            await conn.execute(INIT_SQL)
+            await _migrate_entries_partitioned(conn)
+            await conn.execute(ENTRIES_INDEX_SQL)
+            await conn.execute(BACKFILL_SQL)
+            for campaign in sorted({t.campaign for t in TENANTS}):
+                await conn.execute(sql.SQL("create table if not exists {} partition of public.entries for values in ({})")
+                                   .format(_partition(campaign), sql.Literal(campaign)))
+        finally:
+            await conn.execute("select pg_advisory_unlock(%s)", (SCHEMA_LOCK_KEY,))
+    _SCHEMA_READY = True
     logger.info("Postgres готов: таблицы проверены/созданы.")
 
 
-async def set_bot_commands() -> None:
+def _set_db_healthy(ok: bool) -> None:
+    global _DB_HEALTHY
+    if ok != _DB_HEALTHY:
+        if ok:
+            logger.info("БД доступна, регистрации идут в БД.")
+        else:
+            logger.warning("БД недоступна, регистрации идут в журнал до переподключения.")
+    _DB_HEALTHY = ok
+
+
+def _partition(campaign: str) -> sql.Identifier:
+    return sql.Identifier("public", f"entries_c_{campaign}")
+
+
+async def _migrate_entries_partitioned(conn) -> None:
+    async with conn.cursor(row_factory=tuple_row) as cur:
+        await cur.execute("select relkind from pg_class where oid = to_regclass('public.entries')")
+        row = await cur.fetchone()
+    if not row or row[0] != "r":  # 'p' — уже секционирована
+        return
+    logger.info("entries: перевожу в секционированную по кампаниям, старые заявки — кампания %r", LEGACY_CAMPAIGN)
+    for stmt in ENTRIES_MIGRATION_PREPARE:
+        await conn.execute(stmt)
+    async with conn.transaction():
+        await conn.execute(ENTRIES_MIGRATION_SWAP)
+    for stmt in ENTRIES_MIGRATION_CLEANUP:
+        await conn.execute(stmt)
+    logger.info("entries: миграция завершена.")
+
+
+def _db_overloaded() -> bool:
+    if POOL is None:
+        return False
+    return POOL.get_stats().get("requests_waiting", 0) >= config.DB_OVERLOAD_WAITING
+
+
+async def set_bot_commands(t: Tenant) -> None:
     base_cmds = [
         BotCommand(command="start", description="Начать"),
         BotCommand(command="my", description="Мои коды"),
+        BotCommand(command="top", description="Рейтинг"),
         BotCommand(command="prefs", description="Уведомления"),
         BotCommand(command="whoami", description="Мой ID"),
     ]
-    await bot.set_my_commands(base_cmds, scope=BotCommandScopeAllPrivateChats())
+    await t.bot.set_my_commands(base_cmds, scope=BotCommandScopeAllPrivateChats())
 
     admin_cmds = base_cmds + [
         BotCommand(command="admin", description="Админ-панель"),
         BotCommand(command="export", description="Выгрузить CSV"),
         BotCommand(command="draw", description="Розыгрыш"),
         BotCommand(command="stats", description="Статистика"),
+        BotCommand(command="archive", description="Кампании и архив"),
+        BotCommand(command="profile", description="Профилировщик"),
     ]
-    for admin_id in getattr(config, "ADMIN_IDS", []):
+    for admin_id in t.admin_ids:
         try:
-            await bot.set_my_commands(admin_cmds, scope=BotCommandScopeChat(chat_id=admin_id))
+            await t.bot.set_my_commands(admin_cmds, scope=BotCommandScopeChat(chat_id=admin_id))
         except Exception as e:
-            logger.warning("Не удалось назначить команды для админа %s: %s", admin_id, e)
+            logger.warning("Не удалось назначить команды для админа %s (%s): %s", admin_id, t.slug, e)
 
 
 def channel_url() -> str:
-    return f"tg://resolve?domain={REQ_CH_USERNAME}" if REQ_CH_USERNAME else "tg://resolve"
+    username = tenant().channel_username
+    return f"tg://resolve?domain={username}" if username else "tg://resolve"
 
 
 def not_subscribed_kb(code_lc: str) -> InlineKeyboardMarkup:
@@ -201,15 +610,18 @@ def not_subscribed_kb(code_lc: str) -> InlineKeyboardMarkup:
 
 async def is_subscribed(user_id: int) -> bool:
     ok_status = {"member", "administrator", "creator"}
-    if REQ_CH_USERNAME:
+    t = tenant()
+    if t.channel_username:
         try:
-            m = await bot.get_chat_member(chat_id=f"@{REQ_CH_USERNAME}", user_id=user_id)
+            m = await t.bot.get_chat_member(chat_id=f"@{t.channel_username}", user_id=user_id)
             if m.status in ok_status:
                 return True
         except Exception as e:
             logger.info("get_chat_member username fail: %s", e)
+    if not t.channel_id:
+        return False
     try:
-        m = await bot.get_chat_member(chat_id=REQ_CH_ID, user_id=user_id)
+        m = await t.bot.get_chat_member(chat_id=t.channel_id, user_id=user_id)
         return m.status in ok_status
     except Exception as e:
         logger.info("get_chat_member id fail: %s", e)
@@ -217,17 +629,20 @@ async def is_subscribed(user_id: int) -> bool:
 
 
 # ---------- ДАННЫЕ ----------
+# users — общие для всех тенантов; остальные таблицы фильтруются по tenant().slug
+@TRACER.traced("db.ensure_user")
 async def ensure_user(user_id: int, username: str | None, first_name: str | None) -> str:
     await init_db()
-    async with POOL.connection() as conn:  # type: ignore[union-attr]
+    tid = tenant().slug
+    async with _db_conn() as conn:
         async with conn.cursor(row_factory=tuple_row) as cur:
             await cur.execute("select participant_code from public.users where user_id=%s", (user_id,))
             row = await cur.fetchone()
             if row:
                 await conn.execute("update public.users set username=%s, first_name=%s where user_id=%s",
                                    (username or "", first_name or "", user_id))
-                await conn.execute("insert into public.user_prefs(user_id) values (%s) on conflict (user_id) do nothing",
-                                   (user_id,))
+                await conn.execute("insert into public.user_prefs(tenant_id, user_id) values (%s,%s) "
+                                   "on conflict (tenant_id, user_id) do nothing", (tid, user_id))
                 return row[0]
         # уникальный participant_code
         while True:
@@ -238,69 +653,317 @@ async def ensure_user(user_id: int, username: str | None, first_name: str | None
                     break
         await conn.execute("insert into public.users(user_id, username, first_name, participant_code) "
                            "values (%s,%s,%s,%s)", (user_id, username or "", first_name or "", pc))
-        await conn.execute("insert into public.user_prefs(user_id) values (%s) on conflict (user_id) do nothing",
-                           (user_id,))
+        await conn.execute("insert into public.user_prefs(tenant_id, user_id) values (%s,%s) "
+                           "on conflict (tenant_id, user_id) do nothing", (tid, user_id))
         return pc
 
 
-async def register_entry(user_id: int, username: str | None, first_name: str | None, code: str) -> tuple[int, bool, str]:
+@TRACER.traced("db.register_entry")
+async def register_entry(user_id: int, username: str | None, first_name: str | None, code: str,
+                         created_at: dt.datetime | None = None, campaign: str | None = None) -> tuple[int, bool, str]:
     await init_db()
+    tid = tenant().slug
+    campaign = campaign or tenant().campaign
     participant_code = await ensure_user(user_id, username, first_name)
-    async with POOL.connection() as conn:  # type: ignore[union-attr]
+    async with _db_conn() as conn:
         async with conn.cursor(row_factory=tuple_row) as cur:
-            await cur.execute("select entry_number from public.entries where user_id=%s and code=%s", (user_id, code))
-            row = await cur.fetchone()
-            if row:
-                return row[0], False, participant_code
+            await cur.execute("select code, entry_number from public.entries "
+                              "where tenant_id=%s and campaign=%s and user_id=%s", (tid, campaign, user_id))
+            existing = dict(await cur.fetchall())
+            if code in existing:
+                return existing[code], False, participant_code
+        # номера участников — свои в каждой кампании
         async with conn.cursor(row_factory=tuple_row) as cur:
-            await cur.execute("select coalesce(max(entry_number),0) from public.entries")
+            await cur.execute("select coalesce(max(entry_number),0) from public.entries "
+                              "where tenant_id=%s and campaign=%s", (tid, campaign))
             max_number = (await cur.fetchone())[0] or 0
         new_number = int(max_number) + 1
-        await conn.execute("insert into public.entries(user_id, username, first_name, code, entry_number, created_at) "
-                           "values (%s,%s,%s,%s,%s,%s)",
-                           (user_id, username or "", first_name or "", code, new_number, dt.datetime.now()))
+        created_at = created_at or dt.datetime.now()
+        # on conflict — чтобы повторное применение (журнал, гонка двух апдейтов) не падало;
+        # заявка и агрегаты — одной транзакцией, иначе сбой между ними разошёлся бы со статистикой и рейтингом.
+        # Разделяемый ENTRIES_LOCK_KEY берётся во FROM, т.е. до nextval(id), и держится до коммита
+        async with conn.transaction(), conn.cursor(row_factory=tuple_row) as cur:
+            await cur.execute("insert into public.entries(tenant_id, campaign, user_id, username, first_name, code, "
+                              "entry_number, created_at) select %s,%s,%s,%s,%s,%s,%s,%s "
+                              "from pg_advisory_xact_lock_shared(%s) "
+                              "on conflict (tenant_id, campaign, user_id, code) do nothing returning entry_number",
+                              (tid, campaign, user_id, username or "", first_name or "", code, new_number, created_at,
+                               ENTRIES_LOCK_KEY))
+            if await cur.fetchone() is None:
+                await cur.execute("select entry_number from public.entries "
+                                  "where tenant_id=%s and campaign=%s and user_id=%s and code=%s",
+                                  (tid, campaign, user_id, code))
+                return (await cur.fetchone())[0], False, participant_code
+            await cur.execute(ROLLUP_SQL, {"tenant_id": tid, "campaign": campaign, "ts": created_at, "code": code,
+                                           "new_user": 0 if existing else 1})
+            await cur.execute(SCORE_SQL, {"tenant_id": tid, "campaign": campaign, "user_id": user_id, "ts": created_at})
+        EXPORT_CACHES[tid].mark_dirty()
         return new_number, True, participant_code
 
 
+async def register_entry_durable(user_id: int, username: str | None, first_name: str | None, code: str,
+                                 chat_id: int) -> tuple[int, bool, str] | None:
+    """
+    register_entry, но при недоступной или перегруженной БД регистрация пишется в локальный журнал.
+    None — код принят журналом, номер присвоится при воспроизведении (придёт сообщением в chat_id).
+    """
+    # пока БД лежит, не ждём её на каждой регистрации: переподключается только _journal_replayer
+    if not _DB_HEALTHY:
+        pass
+    elif _db_overloaded():
+        logger.warning("Пул БД перегружен, регистрация user_id=%s уходит в журнал", user_id)
+    else:
+        try:
+            return await register_entry(user_id, username, first_name, code)
+        except psycopg.OperationalError as e:
+            logger.warning("БД недоступна, регистрация user_id=%s уходит в журнал: %s", user_id, e)
+            _set_db_healthy(False)
+    await JOURNAL.append({"tenant": tenant().slug, "campaign": tenant().campaign, "user_id": user_id, "username": username,
+                          "first_name": first_name, "code": code, "chat_id": chat_id, "ts": time.time()})
+    return None
+
+
+async def _apply_journaled_entry(rec: dict) -> None:
+    t = TENANTS.get(rec.get("tenant") or DEFAULT_SLUG)
+    if t is None:
+        logger.warning("Журнал: тенант %r больше не настроен, пропускаю запись user_id=%s",
+                       rec.get("tenant"), rec["user_id"])
+        return
+    token = current_tenant.set(t)
+    try:
+        num, is_new, pcode = await register_entry(rec["user_id"], rec.get("username"), rec.get("first_name"),
+                                                  rec["code"], created_at=dt.datetime.fromtimestamp(rec["ts"]),
+                                                  campaign=rec.get("campaign"))
+        if is_new:
+            text = f"Код {rec['code']} зарегистрирован! Твой постоянный ID: <code>{pcode}</code>\nТы участник №{num}."
+        else:
+            text = f"Код {rec['code']} уже был зарегистрирован как №{num}.\nТвой ID: <code>{pcode}</code>"
+        try:
+            await t.bot.send_message(rec["chat_id"], text)
+        except Exception as e:
+            logger.info("journal notify fail user_id=%s: %s", rec["user_id"], e)
+    finally:
+        current_tenant.reset(token)
+
+
+async def _journal_replayer() -> None:
+    """Применяет журнал и, пока БД недоступна, единственный пытается к ней переподключиться."""
+    delay = 1.0
+    while True:
+        await asyncio.sleep(delay)
+        if _DB_HEALTHY and not JOURNAL.pending:
+            delay = 1.0
+            continue
+        try:
+            # БД и схему поднимаем до записей: ошибка здесь — повод подождать, а не списать запись
+            await connect_db()
+            if JOURNAL.pending:
+                # повторяем только сбои соединения; остальные ошибки — запись в dead-letter
+                applied = await JOURNAL.replay(_apply_journaled_entry, transient=(psycopg.OperationalError,))
+                logger.info("Журнал: применено %s записей, осталось %s", applied, JOURNAL.pending)
+            else:
+                async with _db_conn() as conn:
+                    await conn.execute("select 1")
+            _set_db_healthy(True)
+            delay = 0.0 if JOURNAL.pending else 1.0
+        except Exception as e:
+            _set_db_healthy(False)
+            delay = min(max(delay, 1.0) * 2, 30.0)
+            logger.warning("Журнал: БД ещё недоступна (%s), повтор через %.0fс, отставание %s",
+                           e, delay, JOURNAL.lag())
+
+
+async def start_journal() -> None:
+    global _replayer_task
+    await JOURNAL.open()
+    if _replayer_task is None:
+        _replayer_task = asyncio.create_task(_journal_replayer())
+
+
+async def stop_journal() -> None:
+    global _replayer_task
+    if _replayer_task:
+        _replayer_task.cancel()
+        try:
+            await _replayer_task
+        except asyncio.CancelledError:
+            pass
+        _replayer_task = None
+    await JOURNAL.close()
+
+
+@TRACER.traced("db.get_user_entries")
 async def get_user_entries(user_id: int) -> tuple[str, list[tuple[str, int]]]:
     await init_db()
-    async with POOL.connection() as conn:  # type: ignore[union-attr]
+    async with _db_conn() as conn:
         async with conn.cursor(row_factory=tuple_row) as cur:
             await cur.execute("select participant_code from public.users where user_id=%s", (user_id,))
             row = await cur.fetchone()
             participant_code = row[0] if row else "—"
         async with conn.cursor(row_factory=tuple_row) as cur:
-            await cur.execute("select code, entry_number from public.entries where user_id=%s order by created_at",
-                              (user_id,))
+            await cur.execute("select code, entry_number from public.entries "
+                              "where tenant_id=%s and campaign=%s and user_id=%s order by created_at",
+                              (tenant().slug, tenant().campaign, user_id))
             rows = await cur.fetchall()
     return participant_code, [(r[0], r[1]) for r in rows]
 
 
-async def export_csv() -> bytes:
+@TRACER.traced("db.get_top")
+async def get_top(limit: int = 10) -> list[tuple[int, str, str, int]]:
+    """Топ участников текущей кампании: (место, first_name, username, кол-во кодов). Равный счёт — одно место."""
+    await init_db()
+    t = tenant()
+    async with _db_conn() as conn, conn.cursor(row_factory=tuple_row) as cur:
+        await cur.execute(
+            "select 1 + coalesce((select sum(b.users) from public.score_buckets b "
+            "                     where b.tenant_id = s.tenant_id and b.campaign = s.campaign "
+            "                       and b.codes_count > s.codes_count), 0), "
+            "       u.first_name, u.username, s.codes_count "
+            "from public.user_scores s join public.users u on u.user_id = s.user_id "
+            "where s.tenant_id = %s and s.campaign = %s "
+            "order by s.codes_count desc, s.reached_at, s.user_id limit %s", (t.slug, t.campaign, limit))
+        rows = await cur.fetchall()
+    return [(int(place), first_name or "", username or "", int(n)) for place, first_name, username, n in rows]
+
+
+@TRACER.traced("db.get_rank")
+async def get_rank(user_id: int) -> tuple[int, int, int] | None:
+    """(место, кол-во кодов, всего участников) в текущей кампании или None, если кодов в ней ещё нет."""
+    await init_db()
+    t = tenant()
+    async with _db_conn() as conn, conn.cursor(row_factory=tuple_row) as cur:
+        await cur.execute("select codes_count from public.user_scores where tenant_id=%s and campaign=%s and user_id=%s",
+                          (t.slug, t.campaign, user_id))
+        row = await cur.fetchone()
+        if not row:
+            return None
+        codes_count = int(row[0])
+        await cur.execute("select coalesce(sum(users) filter (where codes_count > %s), 0), coalesce(sum(users), 0) "
+                          "from public.score_buckets where tenant_id=%s and campaign=%s",
+                          (codes_count, t.slug, t.campaign))
+        ahead, total = await cur.fetchone()
+    return int(ahead) + 1, codes_count, int(total)
+
+
+# Заявки после водяного знака: id > last_id и не выше горизонта (_entries_horizon)
+ENTRIES_AFTER_SQL = """
+select id, user_id, username, code, entry_number from public.entries
+ where tenant_id = %(t)s and campaign = %(c)s and id > %(last_id)s and id <= %(upto)s
+ order by id
+"""
+
+
+async def _entries_horizon(conn) -> int:
+    """
+    Наибольший id, ниже которого новых заявок уже не появится.
+    id выдаётся при вставке, а видна строка после коммита: транзакция с меньшим id может
+    закоммититься позже соседки с большим, и водяной знак перескочил бы её навсегда.
+    Вставка держит ENTRIES_LOCK_KEY разделяемо с момента до nextval и до коммита; монопольный
+    замок дожидается всех таких транзакций, и выданное к этому моменту значение последовательности —
+    граница, ниже которой всё закоммичено или откатано. Новые вставки ждут только само это мгновение.
+    """
+    async with conn.transaction(), conn.cursor(row_factory=tuple_row) as cur:
+        await cur.execute("select pg_advisory_xact_lock(%s)", (ENTRIES_LOCK_KEY,))
+        await cur.execute("select coalesce(pg_sequence_last_value('public.entries_id_seq'), 0)")
+        return int((await cur.fetchone())[0])
+
+
+@TRACER.traced("db.entries_horizon")
+async def entries_horizon() -> int:
     await init_db()
-    async with POOL.connection() as conn, conn.cursor(row_factory=tuple_row) as cur:  # type: ignore[union-attr]
-        await cur.execute("select e.user_id, e.username, e.code, e.entry_number from public.entries e order by e.id")
+    async with _db_conn() as conn:
+        return await _entries_horizon(conn)
+
+
+@TRACER.traced("db.fetch_entries_since")
+async def fetch_entries_since(tenant_id: str, campaign: str, last_id: int, upto: int, limit: int) -> list[tuple]:
+    await init_db()
+    async with _db_conn() as conn, conn.cursor(row_factory=tuple_row) as cur:
+        await cur.execute(ENTRIES_AFTER_SQL + " limit %(limit)s",
+                          {"t": tenant_id, "c": campaign, "last_id": last_id, "upto": upto, "limit": limit})
+        return await cur.fetchall()
+
+
+def _export_cache_path(slug: str, campaign: str) -> str:
+    # в имени кампания: .meta хранит водяной знак её файла, и после смены CAMPAIGN файл начинается заново
+    name = f"participants-{campaign}.csv" if slug == DEFAULT_SLUG else f"participants-{slug}-{campaign}.csv"
+    return os.path.join(config.EXPORT_CACHE_DIR, name)
+
+
+EXPORT_CACHES: Dict[str, CsvExportCache] = {
+    t.slug: CsvExportCache(_export_cache_path(t.slug, t.campaign),
+                           functools.partial(fetch_entries_since, t.slug, t.campaign), entries_horizon)
+    for t in TENANTS
+}
+
+
+@TRACER.traced("db.export_csv")
+async def export_csv(campaign: str | None = None) -> bytes:
+    t = tenant()
+    if campaign is None or campaign == t.campaign:
+        # файл текущей кампании дописывается фоном; здесь догоняем только хвост по id
+        data, _ = await EXPORT_CACHES[t.slug].read()
+        return data
+    return await export_campaign_csv(campaign)
+
+
+@TRACER.traced("db.export_campaign_csv")
+async def export_campaign_csv(campaign: str) -> bytes:
+    """Выгрузка прошлой кампании — читает только её секцию."""
+    await init_db()
+    async with _db_conn() as conn, conn.cursor(row_factory=tuple_row) as cur:
+        await cur.execute("select user_id, username, code, entry_number from public.entries "
+                          "where tenant_id=%s and campaign=%s order by id", (tenant().slug, campaign))
+        rows = await cur.fetchall()
+    return rows_to_csv(rows)
+
+
+@TRACER.traced("db.export_csv_delta")
+async def export_csv_delta(admin_id: int) -> tuple[bytes, int, int]:
+    """
+    Заявки, появившиеся после прошлой «новой» выгрузки этого админа.
+    Возвращает (csv, кол-во строк, новый водяной знак); знак сохраняется через set_export_watermark.
+    """
+    await init_db()
+    tid = tenant().slug
+    async with _db_conn() as conn, conn.cursor(row_factory=tuple_row) as cur:
+        await cur.execute("select last_entry_id from public.export_watermarks where tenant_id=%s and admin_id=%s",
+                          (tid, admin_id))
+        row = await cur.fetchone()
+        last_id = int(row[0]) if row else 0
+        upto = await _entries_horizon(conn)
+        await cur.execute(ENTRIES_AFTER_SQL, {"t": tid, "c": tenant().campaign, "last_id": last_id, "upto": upto})
         rows = await cur.fetchall()
-    buff = StringIO()
-    writer = csv.writer(buff)
-    writer.writerow(["user_id", "username", "code", "entry_number"])
-    for r in rows:
-        writer.writerow(r)
-    return buff.getvalue().encode("utf-8")
+    new_last_id = int(rows[-1][0]) if rows else last_id
+    return rows_to_csv([r[1:] for r in rows]), len(rows), new_last_id
+
+
+@TRACER.traced("db.set_export_watermark")
+async def set_export_watermark(admin_id: int, last_entry_id: int) -> None:
+    await init_db()
+    async with _db_conn() as conn:
+        await conn.execute("insert into public.export_watermarks(tenant_id, admin_id, last_entry_id) values (%s,%s,%s) "
+                           "on conflict (tenant_id, admin_id) do update "
+                           "set last_entry_id=excluded.last_entry_id, updated_at=now()",
+                           (tenant().slug, admin_id, last_entry_id))
 
 
-async def draw_weighted_winner() -> dict | None:
+@TRACER.traced("db.draw_weighted_winner")
+async def draw_weighted_winner(campaign: str) -> dict | None:
     await init_db()
-    async with POOL.connection() as conn:  # type: ignore[union-attr]
+    tid = tenant().slug
+    async with _db_conn() as conn:
         async with conn.cursor(row_factory=tuple_row) as cur:
             await cur.execute(
                 "select u.user_id, u.username, u.first_name, u.participant_code, count(distinct e.code) as codes_count "
-                "from public.users u left join public.entries e on e.user_id=u.user_id "
-                "group by u.user_id, u.username, u.first_name, u.participant_code"
+                "from public.entries e join public.users u on u.user_id=e.user_id "
+                "where e.tenant_id=%s and e.campaign=%s "
+                "group by u.user_id, u.username, u.first_name, u.participant_code", (tid, campaign)
             )
             users = await cur.fetchall()
-        async with POOL.connection() as conn2, conn2.cursor(row_factory=tuple_row) as cur2:
-            await cur2.execute("select user_id, code from public.entries")
+        async with _db_conn() as conn2, conn2.cursor(row_factory=tuple_row) as cur2:
+            await cur2.execute("select user_id, code from public.entries where tenant_id=%s and campaign=%s",
+                               (tid, campaign))
             code_rows = await cur2.fetchall()
     if not users:
         return None
@@ -330,36 +993,97 @@ async def draw_weighted_winner() -> dict | None:
     return choice
 
 
+@TRACER.traced("db.get_prefs")
 async def get_prefs(user_id: int) -> Dict[str, bool]:
     await init_db()
-    async with POOL.connection() as conn, conn.cursor(row_factory=tuple_row) as cur:  # type: ignore[union-attr]
-        await cur.execute("select notify_results, notify_new_video, notify_streams from public.user_prefs where user_id=%s", (user_id,))
+    tid = tenant().slug
+    async with _db_conn() as conn, conn.cursor(row_factory=tuple_row) as cur:
+        await cur.execute("select notify_results, notify_new_video, notify_streams from public.user_prefs "
+                          "where tenant_id=%s and user_id=%s", (tid, user_id))
         row = await cur.fetchone()
         if not row:
-            await conn.execute("insert into public.user_prefs(user_id) values (%s) on conflict (user_id) do nothing", (user_id,))
+            await conn.execute("insert into public.user_prefs(tenant_id, user_id) values (%s,%s) "
+                               "on conflict (tenant_id, user_id) do nothing", (tid, user_id))
             return {"notify_results": True, "notify_new_video": True, "notify_streams": True}
     return {"notify_results": bool(row[0]), "notify_new_video": bool(row[1]), "notify_streams": bool(row[2])}
 
 
+@TRACER.traced("db.toggle_pref")
 async def toggle_pref(user_id: int, field: str) -> Dict[str, bool]:
     assert field in ("notify_results", "notify_new_video", "notify_streams")
     await init_db()
-    async with POOL.connection() as conn:  # type: ignore[union-attr]
-        await conn.execute("insert into public.user_prefs(user_id) values (%s) on conflict (user_id) do nothing", (user_id,))
-        await conn.execute(f"update public.user_prefs set {field}=not {field}, updated_at=now() where user_id=%s", (user_id,))
+    tid = tenant().slug
+    async with _db_conn() as conn:
+        await conn.execute("insert into public.user_prefs(tenant_id, user_id) values (%s,%s) "
+                           "on conflict (tenant_id, user_id) do nothing", (tid, user_id))
+        await conn.execute(f"update public.user_prefs set {field}=not {field}, updated_at=now() "
+                           "where tenant_id=%s and user_id=%s", (tid, user_id))
     return await get_prefs(user_id)
 
 
+@TRACER.traced("db.list_subscribers_for")
 async def list_subscribers_for(kind: str) -> List[int]:
     field_map = {"video": "notify_new_video", "results": "notify_results", "streams": "notify_streams"}
     field = field_map[kind]
     await init_db()
-    async with POOL.connection() as conn, conn.cursor(row_factory=tuple_row) as cur:  # type: ignore[union-attr]
-        await cur.execute(f"select u.user_id from public.user_prefs p join public.users u on u.user_id=p.user_id where p.{field}=true")
+    async with _db_conn() as conn, conn.cursor(row_factory=tuple_row) as cur:
+        await cur.execute(f"select u.user_id from public.user_prefs p join public.users u on u.user_id=p.user_id "
+                          f"where p.tenant_id=%s and p.{field}=true", (tenant().slug,))
         rows = await cur.fetchall()
     return [int(r[0]) for r in rows]
 
 
+@TRACER.traced("db.list_campaigns")
+async def list_campaigns() -> list[tuple[str, int]]:
+    """Секции entries: (кампания, примерное число строк по статистике планировщика, -1 — ещё не собрана)."""
+    await init_db()
+    async with _db_conn() as conn, conn.cursor(row_factory=tuple_row) as cur:
+        await cur.execute("select c.relname, c.reltuples::bigint from pg_inherits i "
+                          "join pg_class c on c.oid = i.inhrelid "
+                          "where i.inhparent = 'public.entries'::regclass order by c.relname")
+        rows = await cur.fetchall()
+    return [(name.removeprefix("entries_c_"), int(n)) for name, n in rows]
+
+
+@TRACER.traced("db.archive_campaign")
+async def archive_campaign(campaign: str) -> tuple[int, str | None]:
+    """
+    Отцепить секцию кампании от entries: розыгрыши, статистика и выгрузки её больше не видят;
+    её рейтинг и почасовые агрегаты удаляются.
+    С ARCHIVE_DIR секция выгружается в .csv.gz и удаляется, без — остаётся в БД отдельной таблицей.
+    Возвращает (число заявок, путь к архиву или None).
+    """
+    await init_db()
+    part = _partition(campaign)
+    async with _db_conn() as conn:
+        async with conn.cursor(row_factory=tuple_row) as cur:
+            await cur.execute("select count(*) from public.entries where campaign=%s", (campaign,))
+            rows = int((await cur.fetchone())[0])
+        async with conn.transaction():
+            for table in ("stats_hourly", "stats_hourly_codes", "user_scores", "score_buckets"):
+                await conn.execute(sql.SQL("delete from public.{} where campaign=%s").format(sql.Identifier(table)),
+                                   (campaign,))
+            await conn.execute(sql.SQL("alter table public.entries detach partition {}").format(part))
+        logger.info("Кампания %r отцеплена от entries (%s заявок)", campaign, rows)
+        if not config.ARCHIVE_DIR:
+            return rows, None
+        path = os.path.join(config.ARCHIVE_DIR, f"entries-{campaign}-{dt.datetime.now():%Y%m%d-%H%M%S}.csv.gz")
+        async with conn.cursor() as cur:
+            async with cur.copy(sql.SQL("copy {} to stdout with (format csv, header)").format(part)) as copy:
+                size = await write_gzip(copy, path)
+        await conn.execute(sql.SQL("drop table {}").format(part))
+    logger.info("Кампания %r выгружена в %s (%s байт), таблица удалена", campaign, path, size)
+    return rows, path
+
+
+@TRACER.traced("db.campaign_tenants")
+async def campaign_tenants(campaign: str) -> list[str]:
+    await init_db()
+    async with _db_conn() as conn, conn.cursor(row_factory=tuple_row) as cur:
+        await cur.execute("select distinct tenant_id from public.entries where campaign=%s", (campaign,))
+        return [r[0] for r in await cur.fetchall()]
+
+
 # ---------- FSM ----------
 class BroadcastState(StatesGroup):
     btype = State()
@@ -370,12 +1094,14 @@ class BroadcastState(StatesGroup):
 def admin_keyboard() -> types.InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
     kb.button(text="📥 Экспорт CSV", callback_data="admin:export")
+    kb.button(text="🆕 Новые заявки CSV", callback_data="admin:export:new")
     kb.button(text="🎯 Розыгрыш", callback_data="admin:draw")
     kb.button(text="📊 Статистика", callback_data="admin:stats")
+    kb.button(text="📈 По часам", callback_data="admin:stats:hourly")
     kb.button(text="📢 Рассылка: видео", callback_data="admin:broadcast:video")
     kb.button(text="🔴 Рассылка: стрим", callback_data="admin:broadcast:streams")
     kb.button(text="🏆 Рассылка: результаты", callback_data="admin:broadcast:results")
-    kb.adjust(2, 2, 2)
+    kb.adjust(2, 2, 2, 2)
     return kb.as_markup()
 
 
@@ -390,6 +1116,19 @@ def prefs_keyboard(prefs: Dict[str, bool]) -> types.InlineKeyboardMarkup:
     return kb.as_markup()
 
 
+# ---------- ТРОТТЛИНГ ----------
+THROTTLER = Throttler({
+    "code_miss": Budget.parse(config.THROTTLE_CODE_MISS),
+    "code": Budget.parse(config.THROTTLE_CODE),
+    "subchk": Budget.parse(config.THROTTLE_SUBCHK),
+    "prefs": Budget.parse(config.THROTTLE_PREFS),
+}, max_keys=config.THROTTLE_MAX_USERS)
+_throttling = ThrottlingMiddleware(THROTTLER, lambda data: data["tenant"].valid_codes, exempt=is_admin,
+                                   scope=lambda data: data["tenant"].slug)
+dp.message.outer_middleware(_throttling)
+dp.callback_query.outer_middleware(_throttling)
+
+
 # ---------- ХЭНДЛЕРЫ ----------
 @dp.message(Command("whoami"))
 async def cmd_whoami(message: types.Message):
@@ -400,14 +1139,15 @@ async def cmd_whoami(message: types.Message):
 async def cmd_start(message: types.Message) -> None:
     logger.info("/start from user_id=%s", message.from_user.id)
     pcode = await ensure_user(message.from_user.id, message.from_user.username, message.from_user.first_name)
-    text = ("👋 Йо! Это Moozee_Movie Prizes.\n"
+    t = tenant()
+    text = (f"👋 Йо! Это {t.title}.\n"
             "1) Найди код в видео\n2) Введи сюда\n3) Получи номер в розыгрыше\n\n"
-            f"⚠️ Только для подписчиков канала 👉 <a href=\"tg://resolve?domain={REQ_CH_USERNAME}\">@{REQ_CH_USERNAME}</a>\n\n"
-            f"Твой ID участника: <code>{pcode}</code>\nКоманды: /my, /prefs")
+            f"⚠️ Только для подписчиков канала 👉 <a href=\"tg://resolve?domain={t.channel_username}\">@{t.channel_username}</a>\n\n"
+            f"Твой ID участника: <code>{pcode}</code>\nКоманды: /my, /top, /prefs")
     await message.answer(text)
 
 
-@dp.message(Command("my")))
+@dp.message(Command("my"))
 async def cmd_my(message: types.Message) -> None:
     logger.info("/my from user_id=%s", message.from_user.id)
     pcode, entries = await get_user_entries(message.from_user.id)
@@ -417,6 +1157,27 @@ async def cmd_my(message: types.Message) -> None:
     lines = [f"Твой ID: <code>{pcode}</code>", "Твои коды:"]
     for code, number in entries:
         lines.append(f"№{number} — {code}")
+    rank = await get_rank(message.from_user.id)
+    if rank:
+        place, _, total = rank
+        lines.append(f"\n🏆 Место в рейтинге: {place} из {total} (/top)")
+    await message.answer("\n".join(lines))
+
+
+@dp.message(Command("top"))
+async def cmd_top(message: types.Message) -> None:
+    logger.info("/top from user_id=%s", message.from_user.id)
+    top = await get_top(10)
+    if not top:
+        return await message.answer("Рейтинг пока пуст — стань первым!")
+    lines = ["🏆 Топ по найденным кодам:"]
+    for place, first_name, username, n in top:
+        who = html.escape(first_name or (f"@{username}" if username else "Участник"))
+        lines.append(f"{place}. {who} — {n}")
+    rank = await get_rank(message.from_user.id)
+    if rank:
+        place, n, total = rank
+        lines.append(f"\nТы: {place} место из {total}, кодов: {n}")
     await message.answer("\n".join(lines))
 
 
@@ -447,11 +1208,23 @@ async def cmd_admin(message: types.Message) -> None:
 
 
 @dp.message(Command("stats"))
-async def cmd_stats(message: types.Message) -> None:
+async def cmd_stats(message: types.Message, command: CommandObject) -> None:
     if not is_admin(message.from_user.id):
         return
-    logger.info("/stats by %s", message.from_user.id)
-    text = await build_stats_text()
+    args = (command.args or "").split()
+    if args and args[0].lower() == "hours":
+        rest = args[1:]
+        hours = int(rest.pop(0)) if rest and rest[0].isdigit() else 24
+        campaign = _campaign_arg(rest[0] if rest else None)
+        if campaign is None:
+            return await message.answer("Использование: /stats hours [N] [кампания]")
+        logger.info("/stats hours %s %s by %s", hours, campaign, message.from_user.id)
+        return await message.answer(await build_hourly_stats_text(hours, campaign))
+    campaign = _campaign_arg(args[0] if args else None)
+    if campaign is None:
+        return await message.answer("Использование: /stats [кампания] или /stats hours [N] [кампания]")
+    logger.info("/stats %s by %s", campaign, message.from_user.id)
+    text = await build_stats_text(campaign)
     await message.answer(text)
 
 
@@ -461,20 +1234,68 @@ async def cb_admin_stats(cb: CallbackQuery):
         return await cb.answer("Недоступно", show_alert=True)
     logger.info("admin:stats by %s", cb.from_user.id)
     await cb.answer("Считаю…")
-    text = await build_stats_text()
+    text = await build_stats_text(tenant().campaign)
     await cb.message.answer(text)
 
 
-async def build_stats_text() -> str:
+@dp.callback_query(F.data == "admin:stats:hourly")
+async def cb_admin_stats_hourly(cb: CallbackQuery):
+    if not is_admin(cb.from_user.id):
+        return await cb.answer("Недоступно", show_alert=True)
+    logger.info("admin:stats:hourly by %s", cb.from_user.id)
+    await cb.answer("Считаю…")
+    await cb.message.answer(await build_hourly_stats_text(24, tenant().campaign))
+
+
+@TRACER.traced("db.build_hourly_stats_text")
+async def build_hourly_stats_text(hours: int, campaign: str) -> str:
+    """Ряд по часам и разбивка по кодам кампании — только из агрегатов stats_hourly*, без чтения entries."""
+    hours = max(1, min(hours, 168))
+    last_hour = dt.datetime.now().replace(minute=0, second=0, microsecond=0)
+    since = last_hour - dt.timedelta(hours=hours - 1)
+    tc = {"t": tenant().slug, "c": campaign, "since": since, "last": last_hour}
+    await init_db()
+    async with _db_conn() as conn, conn.cursor(row_factory=tuple_row) as cur:
+        await cur.execute(
+            "select g.hour, coalesce(s.entries, 0), coalesce(s.new_users, 0), "
+            "       (select count(*) from public.stats_hourly_codes c "
+            "         where c.tenant_id = %(t)s and c.campaign = %(c)s and c.hour = g.hour) "
+            "from generate_series(%(since)s::timestamp, %(last)s::timestamp, interval '1 hour') g(hour) "
+            "left join public.stats_hourly s on s.tenant_id = %(t)s and s.campaign = %(c)s and s.hour = g.hour "
+            "order by g.hour", tc)
+        series = await cur.fetchall()
+        await cur.execute("select code, sum(entries) from public.stats_hourly_codes "
+                          "where tenant_id=%(t)s and campaign=%(c)s and hour >= %(since)s "
+                          "group by code order by 2 desc, code", tc)
+        window_codes = await cur.fetchall()
+        await cur.execute("select code, sum(entries) from public.stats_hourly_codes where tenant_id=%(t)s and campaign=%(c)s "
+                          "group by code order by 2 desc, code", tc)
+        total_codes = await cur.fetchall()
+    lines = [f"Статистика за {hours} ч, кампания {campaign} (заявки / новые участники / разных кодов):"]
+    for hour, entries, new_users, codes in series:
+        lines.append(f"<code>{hour:%d.%m %H}:00</code> — {entries} / {new_users} / {codes}")
+    lines.append("")
+    lines.append(f"По кодам за {hours} ч:")
+    lines += [f"{code} — {n}" for code, n in window_codes] or ["—"]
+    lines.append("")
+    lines.append("По кодам за всю кампанию:")
+    lines += [f"{code} — {n}" for code, n in total_codes] or ["—"]
+    return "\n".join(lines)
+
+
+@TRACER.traced("db.build_stats_text")
+async def build_stats_text(campaign: str) -> str:
     await init_db()
-    async with POOL.connection() as conn, conn.cursor(row_factory=tuple_row) as cur:  # type: ignore[union-attr]
-        await cur.execute("select count(*) from public.entries"); total_entries = (await cur.fetchone())[0]
-        await cur.execute("select count(distinct user_id) from public.entries"); unique_users = (await cur.fetchone())[0]
-        await cur.execute("select count(distinct code) from public.entries"); unique_codes = (await cur.fetchone())[0]
-        await cur.execute("select count(*) from public.user_prefs where notify_new_video = true"); subs_video = (await cur.fetchone())[0]
-        await cur.execute("select count(*) from public.user_prefs where notify_streams = true"); subs_streams = (await cur.fetchone())[0]
-        await cur.execute("select count(*) from public.user_prefs where notify_results = true"); subs_results = (await cur.fetchone())[0]
-    return (f"Статистика:\nВсего заявок: {total_entries}\nУникальных пользователей: {unique_users}\n"
+    tid = (tenant().slug,)
+    tc = (tenant().slug, campaign)
+    async with _db_conn() as conn, conn.cursor(row_factory=tuple_row) as cur:
+        await cur.execute("select count(*) from public.entries where tenant_id=%s and campaign=%s", tc); total_entries = (await cur.fetchone())[0]
+        await cur.execute("select count(distinct user_id) from public.entries where tenant_id=%s and campaign=%s", tc); unique_users = (await cur.fetchone())[0]
+        await cur.execute("select count(distinct code) from public.entries where tenant_id=%s and campaign=%s", tc); unique_codes = (await cur.fetchone())[0]
+        await cur.execute("select count(*) from public.user_prefs where tenant_id=%s and notify_new_video = true", tid); subs_video = (await cur.fetchone())[0]
+        await cur.execute("select count(*) from public.user_prefs where tenant_id=%s and notify_streams = true", tid); subs_streams = (await cur.fetchone())[0]
+        await cur.execute("select count(*) from public.user_prefs where tenant_id=%s and notify_results = true", tid); subs_results = (await cur.fetchone())[0]
+    return (f"Статистика (кампания {campaign}):\nВсего заявок: {total_entries}\nУникальных пользователей: {unique_users}\n"
             f"Уникальных кодов: {unique_codes}\n\n"
             f"Уведомления — новые видео: {subs_video}\n"
             f"Уведомления — стримы: {subs_streams}\n"
@@ -482,13 +1303,19 @@ async def build_stats_text() -> str:
 
 
 @dp.message(Command("export"))
-async def cmd_export(message: types.Message) -> None:
+async def cmd_export(message: types.Message, command: CommandObject) -> None:
     if not is_admin(message.from_user.id):
         return
-    logger.info("admin export by %s", message.from_user.id)
+    arg = (command.args or "").strip().lower()
+    if arg == "new":
+        logger.info("admin export new by %s", message.from_user.id)
+        return WORKERS.detach(_send_export_delta(message.from_user.id, message.answer, message.answer_document))
+    campaign = _campaign_arg(arg)
+    if campaign is None:
+        return await message.answer("Использование: /export [new | кампания]")
+    logger.info("admin export %s by %s", campaign, message.from_user.id)
     await message.answer("Готовлю CSV…")
-    csv_bytes = await export_csv()
-    await message.answer_document(BufferedInputFile(csv_bytes, filename="participants.csv"), caption="CSV со списком участников")
+    WORKERS.detach(_send_export(message.answer_document, campaign))
 
 
 @dp.callback_query(F.data == "admin:export")
@@ -497,17 +1324,68 @@ async def cb_admin_export(cb: CallbackQuery):
         return await cb.answer("Недоступно", show_alert=True)
     logger.info("admin:export by %s", cb.from_user.id)
     await cb.answer("Готовлю CSV…")
-    csv_bytes = await export_csv()
-    await cb.message.answer_document(BufferedInputFile(csv_bytes, filename="participants.csv"), caption="CSV со списком участников")
+    WORKERS.detach(_send_export(cb.message.answer_document, tenant().campaign))
+
+
+@dp.callback_query(F.data == "admin:export:new")
+async def cb_admin_export_new(cb: CallbackQuery):
+    if not is_admin(cb.from_user.id):
+        return await cb.answer("Недоступно", show_alert=True)
+    logger.info("admin:export:new by %s", cb.from_user.id)
+    await cb.answer("Готовлю CSV…")
+    WORKERS.detach(_send_export_delta(cb.from_user.id, cb.message.answer, cb.message.answer_document))
+
+
+# выгрузки, /profile и /archive идут через WORKERS.detach — не держат воркер шарда
+async def _send_export(send_doc_fn, campaign: str):
+    csv_bytes = await export_csv(campaign)
+    fname = "participants.csv" if campaign == tenant().campaign else f"participants-{campaign}.csv"
+    await send_doc_fn(BufferedInputFile(csv_bytes, filename=fname),
+                      caption=f"CSV со списком участников (кампания {campaign})")
+
+
+async def _send_export_delta(admin_id: int, send_fn, send_doc_fn):
+    csv_bytes, count, last_id = await export_csv_delta(admin_id)
+    if not count:
+        return await send_fn("Новых заявок с прошлой выгрузки нет.")
+    fname = f"participants-new-{dt.datetime.now():%Y%m%d-%H%M%S}.csv"
+    await send_doc_fn(BufferedInputFile(csv_bytes, filename=fname), caption=f"Новые заявки: {count}")
+    # водяной знак двигаем только после успешной отправки
+    await set_export_watermark(admin_id, last_id)
+
+
+@dp.message(Command("profile"))
+async def cmd_profile(message: types.Message, command: CommandObject) -> None:
+    if not is_admin(message.from_user.id):
+        return
+    arg = (command.args or "").strip()
+    if not arg.isdigit() or not 1 <= int(arg) <= config.PROFILE_MAX_SECONDS:
+        return await message.answer(f"Использование: /profile &lt;секунды&gt; (1–{config.PROFILE_MAX_SECONDS})")
+    if profiler.busy():
+        return await message.answer("Профилирование уже идёт, дождись отчёта.")
+    seconds = int(arg)
+    logger.info("admin profile %ss by %s", seconds, message.from_user.id)
+    await message.answer(f"Профилирую event loop {seconds} с…")
+    WORKERS.detach(_send_profile(message, seconds))
+
+
+async def _send_profile(message: types.Message, seconds: int):
+    report = await profiler.profile_event_loop(seconds)
+    fname = f"profile-{dt.datetime.now():%Y%m%d-%H%M%S}.txt"
+    await message.answer_document(BufferedInputFile(report.encode("utf-8"), filename=fname),
+                                  caption=f"Профиль за {seconds} с")
 
 
 @dp.message(Command("draw"))
-async def cmd_draw(message: types.Message) -> None:
+async def cmd_draw(message: types.Message, command: CommandObject) -> None:
     if not is_admin(message.from_user.id):
         return
-    logger.info("admin draw by %s (command)", message.from_user.id)
+    campaign = _campaign_arg(command.args)
+    if campaign is None:
+        return await message.answer("Использование: /draw [кампания]")
+    logger.info("admin draw %s by %s (command)", campaign, message.from_user.id)
     await message.answer("Запускаю розыгрыш…")
-    await _do_draw_and_send(message.answer)
+    await _do_draw_and_send(message.answer, campaign)
 
 
 @dp.callback_query(F.data == "admin:draw")
@@ -516,16 +1394,16 @@ async def cb_admin_draw(cb: CallbackQuery):
         return await cb.answer("Недоступно", show_alert=True)
     logger.info("admin draw by %s (callback)", cb.from_user.id)
     await cb.answer("Делаю розыгрыш…")
-    await _do_draw_and_send(cb.message.answer)
+    await _do_draw_and_send(cb.message.answer, tenant().campaign)
 
 
-async def _do_draw_and_send(send_fn):
-    winner = await draw_weighted_winner()
+async def _do_draw_and_send(send_fn, campaign: str):
+    winner = await draw_weighted_winner(campaign)
     if not winner:
-        return await send_fn("Пока нет участников для розыгрыша.")
+        return await send_fn(f"В кампании {campaign} пока нет участников для розыгрыша.")
     uname = f"@{winner['username']}" if winner["username"] else f"user_id={winner['user_id']}"
     codes_list = ", ".join(winner["codes"]) if winner["codes"] else "—"
-    text = ("🎉 <b>Победитель розыгрыша!</b>\n"
+    text = (f"🎉 <b>Победитель розыгрыша!</b> (кампания {campaign})\n"
             f"Игрок: <b>{winner['first_name']}</b> ({uname})\n"
             f"ID участника: <code>{winner['participant_code']}</code>\n"
             f"Найдено кодов: <b>{winner['codes_count']}</b>\n"
@@ -533,6 +1411,47 @@ async def _do_draw_and_send(send_fn):
     await send_fn(text)
 
 
+def _campaign_arg(arg: str | None) -> str | None:
+    """Кампания из аргумента команды: пусто — текущая, некорректное имя — None."""
+    arg = (arg or "").strip().lower()
+    if not arg:
+        return tenant().campaign
+    return arg if is_valid_campaign(arg) else None
+
+
+@dp.message(Command("archive"))
+async def cmd_archive(message: types.Message, command: CommandObject) -> None:
+    if not is_admin(message.from_user.id):
+        return
+    arg = (command.args or "").strip().lower()
+    if not arg:
+        campaigns = await list_campaigns()
+        lines = [f"Кампании (текущая — {tenant().campaign}):"]
+        lines += [f"{c} — ~{n if n >= 0 else '?'} заявок" for c, n in campaigns] or ["—"]
+        lines.append("\nАрхивировать: /archive &lt;кампания&gt;")
+        return await message.answer("\n".join(lines))
+    if not is_valid_campaign(arg):
+        return await message.answer("Некорректное имя кампании.")
+    if any(arg == t.campaign for t in TENANTS):
+        return await message.answer(f"Кампания {arg} сейчас идёт — сначала переключи CAMPAIGN.")
+    WORKERS.detach(_archive_and_report(message, arg))
+
+
+async def _archive_and_report(message: types.Message, arg: str):
+    if arg not in {c for c, _ in await list_campaigns()}:
+        return await message.answer(f"Кампании {arg} нет среди секций entries.")
+    others = [tid for tid in await campaign_tenants(arg) if tid != tenant().slug]
+    if others:
+        return await message.answer(f"В кампании {arg} есть заявки других ботов ({', '.join(others)}), не трогаю.")
+    logger.info("admin archive %s by %s", arg, message.from_user.id)
+    await message.answer(f"Архивирую кампанию {arg}…")
+    rows, path = await archive_campaign(arg)
+    if path:
+        await message.answer(f"Готово: {rows} заявок выгружено в <code>{html.escape(path)}</code>, секция удалена.")
+    else:
+        await message.answer(f"Готово: {rows} заявок отцеплено, таблица entries_c_{arg} оставлена в БД.")
+
+
 # ------ Проверка подписки из кнопки "✅ Подписался, проверить"
 @dp.callback_query(F.data.startswith("subchk:"))
 async def cb_check_sub(cb: CallbackQuery):
@@ -541,7 +1460,11 @@ async def cb_check_sub(cb: CallbackQuery):
     if not await is_subscribed(cb.from_user.id):
         return await cb.message.answer("Пока не вижу подписки. Обнови Telegram и попробуй ещё раз.")
     # подписан — добавляем код
-    num, is_new, pcode = await register_entry(cb.from_user.id, cb.from_user.username, cb.from_user.first_name, code_lc)
+    res = await register_entry_durable(cb.from_user.id, cb.from_user.username, cb.from_user.first_name, code_lc,
+                                       cb.message.chat.id)
+    if res is None:
+        return await cb.message.answer(JOURNALED_TEXT)
+    num, is_new, pcode = res
     if is_new:
         await cb.message.answer(f"Принято! Твой постоянный ID: <code>{pcode}</code>\nТы участник №{num} в розыгрыше.")
     else:
@@ -556,9 +1479,16 @@ async def cb_fallback(cb: CallbackQuery):
     # Ничего больше не делаем — но теперь спиннер точно закрыт.
 
 
-UNSUB_TEXT = ("Эй, халявы не будет. Только свои забирают скины.\n"
-              f"Подпишись на 👉 <a href=\"tg://resolve?domain={REQ_CH_USERNAME}\">@{REQ_CH_USERNAME}</a>\n"
-              "и жми «✅ Подписался, проверить».")
+def unsub_text() -> str:
+    ch = tenant().channel_username
+    return ("Эй, халявы не будет. Только свои забирают скины.\n"
+            f"Подпишись на 👉 <a href=\"tg://resolve?domain={ch}\">@{ch}</a>\n"
+            "и жми «✅ Подписался, проверить».")
+
+MISS_TEXT = "Кодовое слово неверно. Попробуй ещё раз."
+
+JOURNALED_TEXT = ("Принято! Код записан ✅\n"
+                  "Сейчас большая нагрузка — номер участника пришлю отдельным сообщением чуть позже.")
 
 
 @dp.message()
@@ -566,14 +1496,17 @@ async def handle_code(message: types.Message) -> None:
     if not (message.text and not message.text.startswith("/")):
         return
     code_lc = message.text.strip().lower()
-    if code_lc not in [c.lower() for c in config.VALID_CODES]:
-        return await message.answer("Кодовое слово неверно. Попробуй ещё раз.")
+    if code_lc not in tenant().valid_codes:
+        return await message.answer(MISS_TEXT)
     if not await is_subscribed(message.from_user.id):
         await ensure_user(message.from_user.id, message.from_user.username, message.from_user.first_name)
-        return await message.answer(UNSUB_TEXT, reply_markup=not_subscribed_kb(code_lc))
-    entry_number, is_new, pcode = await register_entry(
-        message.from_user.id, message.from_user.username, message.from_user.first_name, code_lc
+        return await message.answer(unsub_text(), reply_markup=not_subscribed_kb(code_lc))
+    res = await register_entry_durable(
+        message.from_user.id, message.from_user.username, message.from_user.first_name, code_lc, message.chat.id
     )
+    if res is None:
+        return await message.answer(JOURNALED_TEXT)
+    entry_number, is_new, pcode = res
     if is_new:
         await message.answer(f"Принято! Твой постоянный ID: <code>{pcode}</code>\nТы участник №{entry_number}.")
     else:
@@ -587,67 +1520,192 @@ WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "change-me")
 PORT = int(os.getenv("PORT", "10000"))
 
 
-async def _on_startup(app: web.Application):
-    await init_db()
-    await set_bot_commands()
-    if WEBHOOK_URL:
-        await bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
-        logger.info("Webhook установлен: %s", WEBHOOK_URL)
-
-
-async def _on_shutdown(app: web.Application):
+async def _start_services() -> None:
+    WORKERS.start()
+    await start_journal()
     try:
-        await bot.delete_webhook()
-        logger.info("Webhook снят.")
-    except Exception:
-        pass
-    global POOL
+        await connect_db()
+        _set_db_healthy(True)
+    except psycopg.OperationalError as e:
+        # без БД всё равно поднимаемся: коды примет журнал
+        logger.warning("БД недоступна на старте (%s), регистрации пойдут в журнал.", e)
+    for cache in EXPORT_CACHES.values():
+        cache.start(interval=config.EXPORT_REFRESH_SECONDS)
+
+
+async def _stop_services() -> None:
+    # сначала дорабатываем принятые апдейты — им ещё нужны БД и журнал
+    await WORKERS.stop()
+    for cache in EXPORT_CACHES.values():
+        await cache.stop()
+    await stop_journal()
+    global POOL, _DB_HEALTHY
+    _DB_HEALTHY = False
     if POOL:
         await POOL.close()
         POOL = None
 
 
-async def _process_update_async(data: dict) -> None:
-    try:
-        update = types.Update.model_validate(data)
-        await dp.feed_update(bot, update)
-    except Exception as e:
-        logger.exception("Ошибка обработки апдейта: %s", e)
+# типы апдейтов, на которые есть хэндлеры: их же просим у Telegram и пропускает быстрый путь
+ALLOWED_UPDATES = web.AppKey("allowed_updates", list)
+
+
+def _tenant_webhook_url(t: Tenant) -> str:
+    return WEBHOOK_URL if t.slug == DEFAULT_SLUG else f"{WEBHOOK_URL.rstrip('/')}/{t.slug}"
+
+
+async def _on_startup(app: web.Application):
+    await _start_services()
+    for t in TENANTS:
+        await set_bot_commands(t)
+        if WEBHOOK_URL:
+            await t.bot.set_webhook(url=_tenant_webhook_url(t), secret_token=t.webhook_secret or WEBHOOK_SECRET,
+                                    allowed_updates=app[ALLOWED_UPDATES])
+            logger.info("Webhook установлен [%s]: %s", t.slug, _tenant_webhook_url(t))
+
+
+async def _on_shutdown(app: web.Application):
+    for t in TENANTS:
+        try:
+            await t.bot.delete_webhook()
+            logger.info("Webhook снят [%s].", t.slug)
+        except Exception:
+            pass
+    await _stop_services()
+    for t in TENANTS:
+        await t.bot.session.close()
+
+
+async def _process_update_async(data: dict, t: Tenant) -> None:
+    # исключения ловит и логирует воркер
+    logs.update_id_var.set(data.get("update_id"))
+    with TRACER.start_trace("update", update_id=data.get("update_id")):
+        with TRACER.span("update.validate"):
+            # с контекстом бота: иначе feed_update пересоберёт апдейт ещё раз (model_dump + model_validate)
+            update = types.Update.model_validate(data, context={"bot": t.bot})
+        await dp.feed_update(t.bot, update)
+
+
+async def _metrics(request: web.Request) -> web.Response:
+    lines = [f"prizes_journal_{k} {v}" for k, v in JOURNAL.lag().items()]
+    lines += [f'prizes_throttled_total{{tenant="{slug}",kind="{kind}"}} {v}'
+              for (kind, slug), v in THROTTLER.dropped.items()]
+    lines.append(f"prizes_throttle_buckets {len(THROTTLER)}")
+    lines.append(f"prizes_workers_queued {WORKERS.queued}")
+    lines.append(f"prizes_workers_busy {WORKERS.busy}")
+    lines.append(f"prizes_workers_detached {WORKERS.detached}")
+    lines.append(f"prizes_workers_processed_total {WORKERS.processed}")
+    lines.append(f"prizes_workers_failed_total {WORKERS.failed}")
+    lines.append(f"prizes_workers_wait_max_seconds {WORKERS.take_wait_max():.3f}")
+    lines.append(f"prizes_log_suppressed_total {sum(LOG_SAMPLING.suppressed.values())}")
+    lines += [f'prizes_export_cache_rows{{tenant="{slug}"}} {c.rows}' for slug, c in EXPORT_CACHES.items()]
+    return web.Response(text="\n".join(lines) + "\n")
+
+
+def _fast_reply(verdict: str, msg: dict | None, t: Tenant) -> web.Response | None:
+    """Ответ без pydantic/диспетчера: None — апдейт нужно обработать полностью."""
+    if verdict == ingest.DROP:
+        return web.Response(text="ok")
+    if verdict == ingest.MISS:
+        uid = msg["from"].get("id")
+        if uid not in t.admin_ids and not THROTTLER.allow("code_miss", uid, scope=t.slug):
+            return web.Response(text="ok")
+        # ответ методом прямо в теле ответа вебхука — без отдельного запроса к Bot API
+        body = ingest.dumps({"method": "sendMessage", "chat_id": msg["chat"]["id"], "text": MISS_TEXT})
+        return web.Response(body=body, content_type="application/json")
+    return None
 
 
 def create_app() -> web.Application:
     app = web.Application()
-    app.router.add_get("/health", lambda _: web.Response(text="ok"))
+    app[ALLOWED_UPDATES] = dp.resolve_used_update_types()
+    fast_paths = {t.slug: ingest.FastPath(app[ALLOWED_UPDATES], t.valid_codes) for t in TENANTS} \
+        if config.WEBHOOK_FAST_PATH else {}
+    # без открытого журнала коды при сбое БД некуда сохранить — трафик не принимаем
+    app.router.add_get("/health", lambda _: web.Response(text="ok") if JOURNAL.is_open
+                       else web.Response(status=503, text="journal is not open"))
+    app.router.add_get("/metrics", _metrics)
 
     async def telegram_webhook(request: web.Request) -> web.Response:
-        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+        t = TENANTS.get(request.match_info.get("tenant", DEFAULT_SLUG))
+        if t is None:
+            return web.Response(status=404, text="unknown tenant")
+        secret = t.webhook_secret or WEBHOOK_SECRET
+        if secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret:
             return web.Response(status=403, text="forbidden")
+        if not JOURNAL.is_open:
+            return web.Response(status=503, text="journal is not open")  # Telegram повторит позже
         try:
-            data = await request.json()
+            data = ingest.loads(await request.read())
         except Exception:
             return web.Response(status=400, text="bad json")
-        asyncio.create_task(_process_update_async(data))
+        if not isinstance(data, dict):
+            return web.Response(status=400, text="bad json")
+        fast_path = fast_paths.get(t.slug)
+        if fast_path is not None:
+            resp = _fast_reply(*fast_path.classify(data), t)
+            if resp is not None:
+                return resp
+        # ждёт места в очереди шарда — Telegram увидит медленный ответ и придержит новые апдейты
+        await WORKERS.submit(ingest.update_user_id(data), functools.partial(_process_update_async, data, t),
+                             name=f"update.{ingest.update_kind(data)}")
         return web.Response(text="ok")
 
     app.router.add_post(WEBHOOK_PATH, telegram_webhook)
-    setup_application(app, dp, bot=bot, on_startup=[_on_startup], on_shutdown=[_on_shutdown])
+    app.router.add_post(f"{WEBHOOK_PATH.rstrip('/')}/{{tenant}}", telegram_webhook)
+    setup_application(app, dp, bot=bot)
+    # хуки aiohttp, а не kwargs setup_application: те уходят в workflow data и не вызываются
+    app.on_startup.append(_on_startup)
+    app.on_shutdown.append(_on_shutdown)
     return app
 
 
+async def _poll_all() -> None:
+    """getUpdates по всем тенантам в общий пул воркеров — та же конкурентность, что и у вебхука."""
+    allowed = dp.resolve_used_update_types()
+
+    def handler(t: Tenant):
+        async def handle(update: types.Update) -> None:
+            await WORKERS.submit(workers.update_user_id(update), functools.partial(dp.feed_update, t.bot, update),
+                                 name=f"update.{update.event_type}")
+        return handle
+
+    # один dp на всех ботов: тенант апдейта определяет TenantMiddleware
+    await asyncio.gather(*(
+        workers.poll(t.bot, handler(t), timeout=config.POLL_TIMEOUT, limit=config.POLL_LIMIT, allowed_updates=allowed)
+        for t in TENANTS
+    ))
+
+
 async def _run_polling():
-    await init_db()
-    await set_bot_commands()
-    logger.info("Бот запущен (polling).")
+    await _start_services()
+    for t in TENANTS:
+        await set_bot_commands(t)
+    if not sys.platform.startswith("win"):
+        # SIGTERM (остановка контейнера) — так же аккуратно, как Ctrl+C
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    logger.info("Бот запущен (polling), тенантов: %s, воркеров: %s.", len(TENANTS), WORKERS.shards)
     try:
-        await dp.start_polling(bot)
+        await _poll_all()
     finally:
-        global POOL
-        if POOL:
-            await POOL.close()
-            POOL = None
+        await _stop_services()
+        for t in TENANTS:
+            await t.bot.session.close()
+
+
+def _install_uvloop() -> None:
+    if not config.USE_UVLOOP or sys.platform.startswith("win"):
+        return
+    try:
+        import uvloop
+    except ImportError:
+        return
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    logger.info("uvloop включён.")
 
 
 if __name__ == "__main__":
+    _install_uvloop()
     if WEBHOOK_URL:
         web.run_app(create_app(), host="0.0.0.0", port=PORT)
     else:
@@ -26,3 +26,58 @@ VALID_CODES = [
 # 🧩 Постоянный буквенно‑цифровой ID участника
 PARTICIPANT_CODE_LEN = int(os.getenv("PARTICIPANT_CODE_LEN", "6"))
 PARTICIPANT_CODE_ALPHABET = "abcdefghjkmnpqrstuvwxyzABCDEFGHJKMNPQRSTUVWXYZ23456789"  # без 0/O/1/l
+
+# 📒 Локальный журнал регистраций, если БД недоступна (ENV: ENTRY_JOURNAL_PATH)
+ENTRY_JOURNAL_PATH = (os.getenv("ENTRY_JOURNAL_PATH") or "data/entries.journal").strip()
+# Столько запросов в очереди пула = БД перегружена, регистрации сразу идут в журнал
+DB_OVERLOAD_WAITING = int(os.getenv("DB_OVERLOAD_WAITING", "16"))
+# Сколько ждать первого соединения с БД, секунд (на старте и при переподключении)
+DB_OPEN_TIMEOUT = float(os.getenv("DB_OPEN_TIMEOUT", "10"))
+
+# 🚦 Троттлинг на пользователя: "N/S" — N действий подряд, восстанавливаются за S секунд
+THROTTLE_CODE_MISS = os.getenv("THROTTLE_CODE_MISS", "5/60")   # неверные коды
+THROTTLE_CODE = os.getenv("THROTTLE_CODE", "6/60")             # верные коды (каждый — проверка подписки)
+THROTTLE_SUBCHK = os.getenv("THROTTLE_SUBCHK", "3/30")         # «✅ Подписался, проверить»
+THROTTLE_PREFS = os.getenv("THROTTLE_PREFS", "10/30")          # переключатели уведомлений
+THROTTLE_MAX_USERS = int(os.getenv("THROTTLE_MAX_USERS", "100000"))
+
+# 🔍 Трейсинг апдейтов (ENV: TRACE_EXPORT="jsonl:data/spans.jsonl" или "otlp:http://host:4318/v1/traces")
+TRACE_EXPORT = (os.getenv("TRACE_EXPORT") or "").strip()
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_MAX_PER_SEC = float(os.getenv("TRACE_MAX_PER_SEC", "20"))
+
+# 🩺 /profile: максимальное окно профилирования, секунд
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "120"))
+
+# 📝 Логи: LOG_FORMAT=json|text; для частых строк — доля и потолок в секунду
+# (по умолчанию пишутся все, под нагрузкой их срезает потолок)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").strip()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").strip().lower()
+LOG_HOT_SAMPLE = float(os.getenv("LOG_HOT_SAMPLE", "1.0"))
+LOG_HOT_PER_SEC = float(os.getenv("LOG_HOT_PER_SEC", "20"))
+
+# ⚡ Быстрый путь вебхука (отсев апдейтов до pydantic) и uvloop, если установлен
+WEBHOOK_FAST_PATH = os.getenv("WEBHOOK_FAST_PATH", "1").strip() not in ("0", "false", "no")
+USE_UVLOOP = os.getenv("USE_UVLOOP", "1").strip() not in ("0", "false", "no")
+
+# 📥 Кэш CSV-выгрузки на диске (ENV: EXPORT_CACHE_DIR)
+EXPORT_CACHE_DIR = (os.getenv("EXPORT_CACHE_DIR") or "data/exports").strip()
+EXPORT_REFRESH_SECONDS = float(os.getenv("EXPORT_REFRESH_SECONDS", "10"))
+
+# 🏢 Доп. тенанты (боты/каналы) в этом же процессе: путь к JSON, формат — в tenants.load_specs
+TENANTS_FILE = (os.getenv("TENANTS_FILE") or "").strip()
+
+# 🗂 Кампании: заявки секционированы по кампании (ENV: CAMPAIGN — текущая, латиница/цифры/-/_).
+# Заявки, созданные до секционирования, попадают в кампанию "main".
+CAMPAIGN = (os.getenv("CAMPAIGN") or "main").strip().lower()
+# /archive: куда выгружать отцепленную кампанию (.csv.gz); пусто — оставить в БД отдельной таблицей
+ARCHIVE_DIR = (os.getenv("ARCHIVE_DIR") or "").strip()
+
+# 🧵 Обработка апдейтов (вебхук и polling): шардов по user_id и очередь на шард
+WORKER_SHARDS = int(os.getenv("WORKER_SHARDS", "64"))
+WORKER_QUEUE = int(os.getenv("WORKER_QUEUE", "256"))
+# 📡 Polling (без WEBHOOK_URL): long-poll таймаут getUpdates, секунд, и размер пачки (1–100)
+POLL_TIMEOUT = int(os.getenv("POLL_TIMEOUT", "30"))
+POLL_LIMIT = max(1, min(100, int(os.getenv("POLL_LIMIT", "100"))))
+# 🧪 Свой адрес Bot API (локальный telegram-bot-api или фейковый сервер из bench_polling.py)
+TELEGRAM_API_BASE = (os.getenv("TELEGRAM_API_BASE") or "").strip()
@@ -0,0 +1,178 @@
+# exports.py
+"""
+Кэш CSV-выгрузки участников на диске, дописываемый по мере новых заявок.
+
+Рядом с CSV лежит <file>.meta (JSON): последний выгруженный entries.id и число строк,
+поэтому после рестарта файл не пересобирается. Обновление читает из БД только
+строки с id > last_id (по первичному ключу) и не выше горизонта — id, ниже которого
+новых заявок уже не появится, — и выдача файла не требует полного чтения entries.
+
+Здесь же — запись архива кампании в .csv.gz (поток COPY ... TO STDOUT).
+"""
+from __future__ import annotations
+
+import asyncio
+import csv
+import gzip
+import json
+import logging
+import os
+from io import StringIO
+from typing import AsyncIterable, Awaitable, Callable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("prizes-bot.exports")
+
+CSV_HEADER = ["user_id", "username", "code", "entry_number"]
+
+# fetch(last_id, upto, limit) -> [(id, user_id, username, code, entry_number), ...] по возрастанию id,
+# last_id < id <= upto
+FetchSince = Callable[[int, int, int], Awaitable[List[Sequence]]]
+# horizon() -> наибольший id, ниже которого уже не появится незакоммиченных строк
+Horizon = Callable[[], Awaitable[int]]
+
+
+def rows_to_csv(rows: Sequence[Sequence], header: bool = True) -> bytes:
+    buff = StringIO()
+    writer = csv.writer(buff)
+    if header:
+        writer.writerow(CSV_HEADER)
+    for r in rows:
+        writer.writerow(r)
+    return buff.getvalue().encode("utf-8")
+
+
+async def write_gzip(chunks: AsyncIterable[bytes], path: str) -> int:
+    """
+    Записать поток в path (gzip) атомарно: сначала <path>.tmp, fsync, потом rename.
+    Сжатие и запись — в потоке, чтобы не держать event loop. Возвращает размер файла.
+    """
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    tmp = path + ".tmp"
+    raw = await asyncio.to_thread(open, tmp, "wb")
+    try:
+        gz = gzip.GzipFile(fileobj=raw, mode="wb")
+        async for chunk in chunks:
+            await asyncio.to_thread(gz.write, chunk)
+        await asyncio.to_thread(gz.close)
+        await asyncio.to_thread(raw.flush)
+        await asyncio.to_thread(os.fsync, raw.fileno())
+    except BaseException:
+        raw.close()
+        os.unlink(tmp)
+        raise
+    raw.close()
+    os.replace(tmp, path)
+    return os.path.getsize(path)
+
+
+class CsvExportCache:
+    def __init__(self, path: str, fetch: FetchSince, horizon: Horizon, batch: int = 5000) -> None:
+        self.path = path
+        self.meta_path = path + ".meta"
+        self.fetch = fetch
+        self.horizon = horizon
+        self.batch = batch
+        self.last_id = 0
+        self.rows = 0
+        self._loaded = False
+        self._dirty = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------- СОСТОЯНИЕ ----------
+    def _load_sync(self) -> None:
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if os.path.exists(self.path):
+                self.last_id, self.rows = int(meta["last_id"]), int(meta["rows"])
+                return
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        self._reset_sync()
+
+    def _reset_sync(self) -> None:
+        d = os.path.dirname(self.path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with open(self.path, "wb") as f:
+            f.write(rows_to_csv([]))
+        self.last_id, self.rows = 0, 0
+        self._save_meta_sync()
+
+    def _save_meta_sync(self) -> None:
+        tmp = self.meta_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"last_id": self.last_id, "rows": self.rows}, f)
+        os.replace(tmp, self.meta_path)
+
+    def _append_sync(self, data: bytes, last_id: int, added: int) -> None:
+        with open(self.path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.last_id, self.rows = last_id, self.rows + added
+        self._save_meta_sync()
+
+    # ---------- ОБНОВЛЕНИЕ ----------
+    def mark_dirty(self) -> None:
+        """Появились новые заявки — фоновая задача допишет их в файл."""
+        self._dirty.set()
+
+    async def refresh(self) -> int:
+        """Дописать в файл заявки с last_id < id <= горизонт. Возвращает число добавленных строк."""
+        async with self._lock:
+            if not self._loaded:
+                await asyncio.to_thread(self._load_sync)
+                self._loaded = True
+            added = 0
+            upto = await self.horizon()  # один раз на обновление, дальше — страницы по id
+            while True:
+                rows = await self.fetch(self.last_id, upto, self.batch)
+                if not rows:
+                    break
+                data = rows_to_csv([r[1:] for r in rows], header=False)
+                await asyncio.to_thread(self._append_sync, data, int(rows[-1][0]), len(rows))
+                added += len(rows)
+                if len(rows) < self.batch:
+                    break
+            return added
+
+    async def read(self) -> Tuple[bytes, int]:
+        """Актуальный файл целиком: догоняет хвост и отдаёт (содержимое, число строк)."""
+        await self.refresh()
+        async with self._lock:
+            data = await asyncio.to_thread(self._read_sync)
+            return data, self.rows
+
+    def _read_sync(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    # ---------- ФОН ----------
+    def start(self, interval: float = 10.0) -> None:
+        if self._task is None:
+            self._dirty.set()  # сразу догнать то, что добавилось, пока бот стоял
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, interval: float) -> None:
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning("CSV-кэш: обновление не удалось: %s", e)
+                self._dirty.set()
+            await asyncio.sleep(interval)  # не чаще раза в interval секунд
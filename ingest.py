@@ -0,0 +1,70 @@
+# ingest.py
+"""
+Быстрый путь приёма апдейтов вебхука — до pydantic-валидации.
+
+Сырой JSON разбирается orjson'ом (если установлен), затем по словарю решаем:
+- DROP — апдейт такого типа никто не обрабатывает;
+- MISS — обычный текст с неверным кодом: ответ можно отдать без модели и без БД;
+- FULL — всё остальное идёт в types.Update.model_validate и диспетчер.
+"""
+from __future__ import annotations
+
+import json
+from typing import Any, Iterable, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # orjson — необязательная зависимость
+    orjson = None
+
+DROP, MISS, FULL = "drop", "miss", "full"
+
+
+if orjson is not None:
+    loads = orjson.loads
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+else:
+    loads = json.loads
+
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def update_kind(data: dict) -> Optional[str]:
+    for key in data:
+        if key != "update_id":
+            return key
+    return None
+
+
+def update_user_id(data: dict) -> Optional[int]:
+    """from.id события апдейта (ключ шарда в workers) или None."""
+    kind = update_kind(data)
+    event = data.get(kind) if kind else None
+    user = event.get("from") if isinstance(event, dict) else None
+    uid = user.get("id") if isinstance(user, dict) else None
+    return uid if isinstance(uid, int) else None
+
+
+class FastPath:
+    def __init__(self, allowed_updates: Iterable[str], valid_codes: Iterable[str]) -> None:
+        self.allowed = frozenset(allowed_updates)
+        self.valid_codes = frozenset(c.lower() for c in valid_codes)
+
+    def classify(self, data: dict) -> Tuple[str, Optional[dict]]:
+        """Вернуть (вердикт, message-словарь для MISS)."""
+        kind = update_kind(data)
+        if kind not in self.allowed:
+            return DROP, None
+        if kind == "message":
+            msg = data["message"]
+            text = msg.get("text") if isinstance(msg, dict) else None
+            if not isinstance(text, str) or not text:
+                return DROP, None  # все message-хэндлеры работают только с текстом
+            if (not text.startswith("/")
+                    and isinstance(msg.get("from"), dict) and isinstance(msg.get("chat"), dict)
+                    and text.strip().lower() not in self.valid_codes):
+                return MISS, msg
+        return FULL, None
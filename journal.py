@@ -0,0 +1,288 @@
+# journal.py
+"""
+Локальный append-only журнал регистраций кодов (write-ahead).
+
+Пока Postgres недоступен или перегружен, регистрации пишутся сюда и считаются
+принятыми после fsync. Фоновый воспроизводитель потом применяет их к БД.
+
+Формат записи: [длина:u32 BE][crc32:u32 BE][payload JSON utf-8].
+fsync делается пачками (group commit), а не на каждую запись.
+Смещение уже применённых записей хранится рядом, в файле <path>.ckpt.
+Записи, которые не применяются не из-за БД (битые данные, нарушение ограничений),
+уходят в <path>.dead (JSON-строки с текстом ошибки), чтобы не блокировать остальные.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Type
+
+logger = logging.getLogger("prizes-bot.journal")
+
+_HEADER = struct.Struct(">II")
+_MAX_RECORD = 1 << 20  # защита от мусора в заголовке
+
+
+def _encode(record: dict) -> bytes:
+    payload = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _read_records(path: str, offset: int, limit: int, end: Optional[int] = None) -> Tuple[List[Tuple[int, dict]], int]:
+    """
+    Прочитать до limit целых записей, начиная с offset (и не дальше end).
+    Возвращает [(смещение_конца_записи, запись)] и смещение конца последней целой записи.
+    Обрезанная или битая запись (падение посреди write) считается концом журнала.
+    """
+    out: List[Tuple[int, dict]] = []
+    pos = offset
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return out, pos
+    with f:
+        f.seek(offset)
+        while len(out) < limit:
+            if end is not None and pos >= end:
+                break
+            head = f.read(_HEADER.size)
+            if len(head) < _HEADER.size:
+                break
+            length, crc = _HEADER.unpack(head)
+            if length > _MAX_RECORD:
+                break
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            pos += _HEADER.size + length
+            out.append((pos, json.loads(payload)))
+    return out, pos
+
+
+class EntryJournal:
+    def __init__(self, path: str, flush_interval: float = 0.01, flush_batch: int = 512) -> None:
+        self.path = path
+        self.ckpt_path = path + ".ckpt"
+        self.dead_path = path + ".dead"
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+
+        self._fh = None
+        self._buf: List[bytes] = []
+        self._waiters: List[asyncio.Future] = []
+        self._has_data = asyncio.Event()
+        self._io_lock = asyncio.Lock()
+        self._replay_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+
+        self._size = 0        # длина durable-части файла
+        self._applied = 0     # смещение уже применённых к БД записей
+        self._pending = 0     # записей в журнале, ещё не применённых
+        self._oldest_ts: Optional[float] = None
+        self.appended_total = 0
+        self.replayed_total = 0
+        self.dead_total = 0
+
+    # ---------- ЖИЗНЕННЫЙ ЦИКЛ ----------
+    async def open(self) -> None:
+        if self._fh is not None:
+            return
+        await asyncio.to_thread(self._open_sync)
+        self._flusher = asyncio.create_task(self._flush_loop())
+        if self._pending:
+            logger.warning("Журнал %s: %s неприменённых записей после рестарта", self.path, self._pending)
+
+    def _open_sync(self) -> None:
+        d = os.path.dirname(self.path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        applied = self._load_ckpt()
+        if applied > size:
+            # упали между усечением журнала и записью чекпоинта
+            applied = 0
+        pending, first_ts, end = 0, None, applied
+        while True:
+            recs, end = _read_records(self.path, end, 10_000)
+            if not recs:
+                break
+            if first_ts is None:
+                first_ts = recs[0][1].get("ts")
+            pending += len(recs)
+        if end < size:
+            logger.warning("Журнал %s: отрезаю повреждённый хвост (%s байт)", self.path, size - end)
+        self._fh = open(self.path, "ab")
+        if end < size:
+            os.ftruncate(self._fh.fileno(), end)
+            os.fsync(self._fh.fileno())
+        self._size, self._applied, self._pending, self._oldest_ts = end, applied, pending, first_ts
+        if applied == 0 and end == 0:
+            self._save_ckpt(0)
+
+    async def close(self) -> None:
+        if self._fh is None:
+            return
+        if self._flusher:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        if self._buf:
+            await self._flush()
+        self._fh.close()
+        self._fh = None
+
+    # ---------- ЗАПИСЬ ----------
+    async def append(self, record: dict) -> None:
+        """Добавить запись; возвращается только после fsync (запись durable)."""
+        if self._fh is None:
+            raise RuntimeError("journal is not open")
+        fut = asyncio.get_running_loop().create_future()
+        self._buf.append(_encode(record))
+        self._waiters.append(fut)
+        self._has_data.set()
+        await fut
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await self._has_data.wait()
+            if len(self._buf) < self.flush_batch:
+                await asyncio.sleep(self.flush_interval)  # окно group commit
+            try:
+                await self._flush()
+            except Exception:
+                logger.exception("Журнал: ошибка flush")
+
+    async def _flush(self) -> None:
+        async with self._io_lock:
+            buf, waiters = self._buf, self._waiters
+            self._buf, self._waiters = [], []
+            self._has_data.clear()
+            if not buf:
+                return
+            data = b"".join(buf)
+            try:
+                await asyncio.to_thread(self._write_sync, data)
+            except Exception as e:
+                for w in waiters:
+                    if not w.done():
+                        w.set_exception(e)
+                return
+            self._size += len(data)
+            self._pending += len(buf)
+            self.appended_total += len(buf)
+            if self._oldest_ts is None:
+                self._oldest_ts = time.time()
+            for w in waiters:
+                if not w.done():
+                    w.set_result(None)
+
+    def _write_sync(self, data: bytes) -> None:
+        try:
+            self._fh.write(data)
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+        except Exception:
+            # не оставляем полузаписанную запись посреди журнала
+            try:
+                os.ftruncate(self._fh.fileno(), self._size)
+            except Exception:
+                pass
+            raise
+
+    @property
+    def is_open(self) -> bool:
+        return self._fh is not None
+
+    # ---------- ВОСПРОИЗВЕДЕНИЕ ----------
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def replay(self, apply: Callable[[dict], Awaitable[None]], max_records: int = 500,
+                     transient: Tuple[Type[BaseException], ...] = (Exception,)) -> int:
+        """
+        Применить неприменённые записи по порядку. apply обязан быть идемпотентным:
+        после падения между apply и записью чекпоинта запись применится повторно.
+        Ошибка из transient (недоступна БД) останавливает воспроизведение и пробрасывается —
+        повторим позже с того же места. Любая другая — запись уходит в <path>.dead и пропускается.
+        """
+        async with self._replay_lock:
+            recs, _ = await asyncio.to_thread(_read_records, self.path, self._applied, max_records, self._size)
+            done = 0
+            try:
+                for end, rec in recs:
+                    try:
+                        await apply(rec)
+                    except transient:
+                        raise
+                    except Exception as e:
+                        logger.error("Журнал: запись не применяется (%r), в %s: %s", e, self.dead_path, rec)
+                        await asyncio.to_thread(self._dead_letter_sync, rec, e)
+                        self.dead_total += 1
+                    self._applied = end
+                    done += 1
+            finally:
+                if done:
+                    self._pending -= done
+                    self.replayed_total += done
+                    await asyncio.to_thread(self._save_ckpt, self._applied)
+                    await self._after_replay()
+            return done
+
+    async def _after_replay(self) -> None:
+        if self._pending:
+            nxt, _ = await asyncio.to_thread(_read_records, self.path, self._applied, 1, self._size)
+            self._oldest_ts = nxt[0][1].get("ts") if nxt else self._oldest_ts
+            return
+        self._oldest_ts = None
+        # всё применено — обнуляем журнал, чтобы он не рос бесконечно
+        async with self._io_lock:
+            if self._applied == self._size and not self._buf:
+                await asyncio.to_thread(self._truncate_sync)
+
+    def _truncate_sync(self) -> None:
+        os.ftruncate(self._fh.fileno(), 0)
+        os.fsync(self._fh.fileno())
+        self._size = self._applied = 0
+        self._save_ckpt(0)
+
+    def _dead_letter_sync(self, rec: dict, error: BaseException) -> None:
+        line = json.dumps({"record": rec, "error": repr(error), "at": time.time()}, ensure_ascii=False)
+        with open(self.dead_path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _load_ckpt(self) -> int:
+        try:
+            with open(self.ckpt_path, "r", encoding="ascii") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _save_ckpt(self, offset: int) -> None:
+        tmp = self.ckpt_path + ".tmp"
+        with open(tmp, "w", encoding="ascii") as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.ckpt_path)
+
+    # ---------- МЕТРИКИ ----------
+    def lag(self) -> Dict[str, float]:
+        return {
+            "lag_records": self._pending,
+            "lag_bytes": self._size - self._applied,
+            "oldest_pending_seconds": round(time.time() - self._oldest_ts, 3) if self._oldest_ts else 0.0,
+            "appended_total": self.appended_total,
+            "replayed_total": self.replayed_total,
+            "dead_total": self.dead_total,
+        }
@@ -0,0 +1,137 @@
+# logs.py
+"""
+Неблокирующие логи: поток event loop'а только кладёт запись в очередь,
+форматирование в JSON и запись в поток вывода делает фоновый QueueListener.
+
+К каждой записи добавляются update_id и user_id текущего апдейта (из ContextVar).
+Для «горячих» строк (шаблон сообщения) есть сэмплирование и лимит в секунду —
+лишние записи отбрасываются ещё до постановки в очередь.
+"""
+from __future__ import annotations
+
+import atexit
+import datetime as dt
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from aiogram import BaseMiddleware
+
+update_id_var: ContextVar[Optional[int]] = ContextVar("log_update_id", default=None)
+user_id_var: ContextVar[Optional[int]] = ContextVar("log_user_id", default=None)
+
+
+@dataclass(frozen=True)
+class LogRule:
+    sample: float = 1.0    # доля записей, которые оставляем
+    per_sec: float = 0.0   # потолок записей в секунду, 0 — без лимита
+
+
+class ContextFilter(logging.Filter):
+    """Штампует update_id/user_id в поток event loop'а, пока контекст ещё доступен."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.update_id = update_id_var.get()
+        record.user_id = user_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rules: Dict[str, LogRule]) -> None:
+        super().__init__()
+        self.rules = rules
+        self._window: Dict[str, list] = {}  # шаблон -> [секунда, счётчик]
+        self.suppressed: Dict[str, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rule = self.rules.get(record.msg) if isinstance(record.msg, str) else None
+        if rule is None:
+            return True
+        keep = rule.sample >= 1.0 or random.random() < rule.sample
+        if keep and rule.per_sec > 0:
+            sec = int(time.monotonic())
+            w = self._window.setdefault(record.msg, [sec, 0])
+            if w[0] != sec:
+                w[0], w[1] = sec, 0
+            w[1] += 1
+            keep = w[1] <= rule.per_sec
+        if not keep:
+            self.suppressed[record.msg] = self.suppressed.get(record.msg, 0) + 1
+        return keep
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # форматируем только сообщение; трейсбек — отдельным полем
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        doc: Dict[str, Any] = {
+            "ts": dt.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key in ("update_id", "user_id"):
+            value = getattr(record, key, None)
+            if value is not None:
+                doc[key] = value
+        if record.exc_text:
+            doc["exc"] = record.exc_text
+        return json.dumps(doc, ensure_ascii=False)
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """dp.update outer-middleware: выставляет update_id/user_id для логов хэндлеров."""
+
+    async def __call__(self, handler, event, data):
+        user = getattr(getattr(event, "event", None), "from_user", None)
+        t1 = update_id_var.set(getattr(event, "update_id", None))
+        t2 = user_id_var.set(user.id if user else None)
+        try:
+            return await handler(event, data)
+        finally:
+            update_id_var.reset(t1)
+            user_id_var.reset(t2)
+
+
+def setup_logging(level: str = "INFO", fmt: str = "json",
+                  rules: Optional[Dict[str, LogRule]] = None) -> SamplingFilter:
+    """Перенастроить root-логгер на очередь с фоновым писателем. Возвращает фильтр сэмплирования."""
+    stream = logging.StreamHandler(sys.stderr)
+    if fmt == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s"))
+
+    q: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    qh = _QueueHandler(q)
+    sampling = SamplingFilter(rules or {})
+    qh.addFilter(sampling)
+    qh.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(qh)
+    root.setLevel(level.upper())
+
+    listener = logging.handlers.QueueListener(q, stream, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return sampling
@@ -0,0 +1,122 @@
+# profiler.py
+"""
+Профилирование живого event loop'а по запросу админа.
+
+За окно в N секунд собираем:
+- cProfile по потоку event loop'а (там работают все хэндлеры);
+- лаг event loop'а: насколько позже запланированного просыпается sleep;
+- длительности задач (корутин), созданных за окно, через временную task factory,
+  и заданий пула воркеров — их воркеры сообщают через record().
+"""
+from __future__ import annotations
+
+import asyncio
+import cProfile
+import datetime as dt
+import pstats
+import time
+from collections import defaultdict
+from io import StringIO
+from typing import Dict, List, Optional
+
+_lock = asyncio.Lock()
+_active: Optional["_TaskTimer"] = None
+
+
+def busy() -> bool:
+    return _lock.locked()
+
+
+def record(name: str, seconds: float) -> None:
+    """Длительность работы, выполненной не отдельной задачей (например, апдейт в воркере)."""
+    if _active is not None:
+        _active.durations[name].append(seconds)
+
+
+def _pct(sorted_vals: List[float], q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    return sorted_vals[min(len(sorted_vals) - 1, int(q * len(sorted_vals)))]
+
+
+async def _measure_lag(samples: List[float], interval: float) -> None:
+    while True:
+        t0 = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - t0 - interval))
+
+
+class _TaskTimer:
+    """Подменяет task factory на время окна и копит длительности задач по имени корутины."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+        self.prev = loop.get_task_factory()
+        self.durations: Dict[str, List[float]] = defaultdict(list)
+
+    def __enter__(self) -> "_TaskTimer":
+        global _active
+        self.loop.set_task_factory(self._factory)
+        _active = self
+        return self
+
+    def __exit__(self, *exc) -> None:
+        global _active
+        self.loop.set_task_factory(self.prev)
+        _active = None
+
+    def _factory(self, loop, coro, **kwargs):
+        task = self.prev(loop, coro, **kwargs) if self.prev else asyncio.Task(coro, loop=loop, **kwargs)
+        name = getattr(coro, "__qualname__", type(coro).__name__)
+        start = time.perf_counter()
+        task.add_done_callback(lambda _t: self.durations[name].append(time.perf_counter() - start))
+        return task
+
+
+async def profile_event_loop(seconds: float, top: int = 40, lag_interval: float = 0.05) -> str:
+    """Профилировать текущий event loop seconds секунд и вернуть текстовый отчёт."""
+    async with _lock:
+        loop = asyncio.get_running_loop()
+        lag: List[float] = []
+        started = dt.datetime.now()
+        prof = cProfile.Profile()
+        with _TaskTimer(loop) as timer:
+            lag_task = asyncio.create_task(_measure_lag(lag, lag_interval))
+            prof.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                prof.disable()
+                lag_task.cancel()
+        return _render(started, seconds, prof, lag, timer.durations, top)
+
+
+def _render(started: dt.datetime, seconds: float, prof: cProfile.Profile, lag: List[float],
+            durations: Dict[str, List[float]], top: int) -> str:
+    out = StringIO()
+    out.write(f"Профиль event loop: {started:%Y-%m-%d %H:%M:%S}, окно {seconds:g} с\n\n")
+
+    lag_ms = sorted(x * 1000 for x in lag)
+    out.write("== Лаг event loop (мс) ==\n")
+    if lag_ms:
+        out.write(f"замеров: {len(lag_ms)}  среднее: {sum(lag_ms) / len(lag_ms):.2f}  "
+                  f"p50: {_pct(lag_ms, 0.5):.2f}  p95: {_pct(lag_ms, 0.95):.2f}  "
+                  f"p99: {_pct(lag_ms, 0.99):.2f}  max: {lag_ms[-1]:.2f}\n\n")
+    else:
+        out.write("нет замеров\n\n")
+
+    out.write("== Самые медленные корутины (задачи и задания воркеров, завершённые за окно) ==\n")
+    rows = sorted(((name, sorted(v)) for name, v in durations.items()), key=lambda r: r[1][-1], reverse=True)
+    if rows:
+        out.write(f"{'max, мс':>10} {'p95, мс':>10} {'всего, с':>9} {'кол-во':>7}  корутина\n")
+        for name, vals in rows[:top]:
+            out.write(f"{vals[-1] * 1000:10.1f} {_pct(vals, 0.95) * 1000:10.1f} {sum(vals):9.2f} {len(vals):7d}  {name}\n")
+    else:
+        out.write("задач не было\n")
+    out.write("\n")
+
+    for sort_key, title in (("cumulative", "cProfile: по cumulative time"), ("tottime", "cProfile: по own time")):
+        out.write(f"== {title} ==\n")
+        stats = pstats.Stats(prof, stream=out)
+        stats.strip_dirs().sort_stats(sort_key).print_stats(top)
+    return out.getvalue()
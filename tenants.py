@@ -0,0 +1,115 @@
+# tenants.py
+"""
+Мульти-тенантность: несколько ботов/каналов в одном процессе.
+
+Тенант — это бот, обязательный канал, набор кодов и админы. Таблицы в БД
+разделены колонкой tenant_id, пул соединений общий. Текущий тенант апдейта
+лежит в ContextVar: его выставляет TenantMiddleware по боту, принявшему апдейт
+(вебхук отдаёт апдейт боту своего пути WEBHOOK_PATH/<tenant>, polling — своему).
+"""
+from __future__ import annotations
+
+import json
+import re
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional
+
+from aiogram import BaseMiddleware, Bot
+
+DEFAULT_SLUG = "default"
+_SLUG_RE = re.compile(r"^[a-z0-9][a-z0-9_-]{0,31}$")
+
+
+@dataclass
+class Tenant:
+    slug: str
+    bot: Bot
+    channel_username: str
+    channel_id: int
+    valid_codes: FrozenSet[str]            # в нижнем регистре
+    admin_ids: FrozenSet[int] = frozenset()
+    webhook_secret: str = ""
+    title: str = "Moozee_Movie Prizes"
+    campaign: str = "main"                 # текущая кампания: в неё пишутся заявки, по ней розыгрыш/выгрузка
+
+
+current_tenant: ContextVar[Optional[Tenant]] = ContextVar("current_tenant", default=None)
+
+
+class TenantRegistry:
+    def __init__(self) -> None:
+        self.by_slug: Dict[str, Tenant] = {}
+        self.by_bot_id: Dict[int, Tenant] = {}
+
+    def add(self, tenant: Tenant) -> None:
+        if not _SLUG_RE.match(tenant.slug):
+            raise ValueError(f"bad tenant slug: {tenant.slug!r}")
+        if tenant.slug in self.by_slug:
+            raise ValueError(f"duplicate tenant slug: {tenant.slug!r}")
+        if not is_valid_campaign(tenant.campaign):
+            raise ValueError(f"bad campaign for tenant {tenant.slug!r}: {tenant.campaign!r}")
+        if tenant.bot.id in self.by_bot_id:
+            raise ValueError(f"bot {tenant.bot.id} is already used by tenant {self.by_bot_id[tenant.bot.id].slug!r}")
+        self.by_slug[tenant.slug] = tenant
+        self.by_bot_id[tenant.bot.id] = tenant
+
+    def get(self, slug: str) -> Optional[Tenant]:
+        return self.by_slug.get(slug)
+
+    def for_bot(self, bot: Bot) -> Optional[Tenant]:
+        return self.by_bot_id.get(bot.id)
+
+    def __iter__(self):
+        return iter(self.by_slug.values())
+
+    def __len__(self) -> int:
+        return len(self.by_slug)
+
+
+def load_specs(path: str) -> List[Dict[str, Any]]:
+    """
+    JSON-файл со списком тенантов:
+    [{"slug": "creator2", "bot_token": "...", "channel_username": "...", "channel_id": -100...,
+      "codes": ["CODE1", "CODE2"], "admin_ids": [111], "webhook_secret": "...", "title": "...", "campaign": "2026-10"}]
+    """
+    if not path:
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        specs = json.load(f)
+    if not isinstance(specs, list):
+        raise ValueError("TENANTS_FILE must contain a JSON list")
+    for spec in specs:
+        for key in ("slug", "bot_token", "codes"):
+            if not spec.get(key):
+                raise ValueError(f"tenant spec is missing {key!r}: {spec.get('slug')!r}")
+        if spec["slug"] == DEFAULT_SLUG:
+            raise ValueError(f"tenant slug {DEFAULT_SLUG!r} is reserved for the env-configured bot")
+    return specs
+
+
+def is_valid_campaign(name: str) -> bool:
+    """Имя кампании идёт в имя секции entries_c_<campaign>, поэтому те же правила, что и для slug."""
+    return bool(_SLUG_RE.match(name))
+
+
+def lower_codes(codes: Iterable[str]) -> FrozenSet[str]:
+    return frozenset(c.strip().lower() for c in codes if c.strip())
+
+
+class TenantMiddleware(BaseMiddleware):
+    """dp.update outer-middleware: тенант по боту апдейта → ContextVar и data["tenant"]."""
+
+    def __init__(self, registry: TenantRegistry) -> None:
+        self.registry = registry
+
+    async def __call__(self, handler, event, data):
+        tenant = self.registry.for_bot(data["bot"])
+        if tenant is None:
+            return None
+        data["tenant"] = tenant
+        token = current_tenant.set(tenant)
+        try:
+            return await handler(event, data)
+        finally:
+            current_tenant.reset(token)
@@ -0,0 +1,130 @@
+# throttling.py
+"""
+Пер-пользовательский троттлинг на token bucket'ах.
+
+Бакеты живут в памяти, в ограниченном LRU-словаре. Бакет, простоявший дольше
+времени полного восстановления, ничем не отличается от нового, поэтому такие
+записи выкидываются. Бюджеты для разных видов действий считаются раздельно.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+logger = logging.getLogger("prizes-bot.throttling")
+
+
+@dataclass(frozen=True)
+class Budget:
+    capacity: float  # сколько действий подряд (burst)
+    rate: float      # токенов в секунду
+
+    @classmethod
+    def parse(cls, spec: str) -> "Budget":
+        """'5/60' — 5 действий подряд, полностью восстанавливаются за 60 секунд."""
+        n, per = spec.split("/", 1)
+        capacity = float(n)
+        return cls(capacity=capacity, rate=capacity / float(per))
+
+    @property
+    def idle_ttl(self) -> float:
+        return self.capacity / self.rate if self.rate > 0 else float("inf")
+
+
+class Throttler:
+    def __init__(self, budgets: Dict[str, Budget], max_keys: int = 100_000) -> None:
+        self.budgets = budgets
+        self.max_keys = max_keys
+        # (kind, scope, key) -> [tokens, updated_at]
+        self._buckets: "OrderedDict[Tuple[str, Any, Any], list]" = OrderedDict()
+        # (kind, scope) -> сколько отброшено
+        self.dropped: Dict[Tuple[str, Any], int] = defaultdict(int)
+
+    def allow(self, kind: str, key: Any, scope: Any = None, now: Optional[float] = None) -> bool:
+        """key — обычно user_id; scope — пространство ключей (например, тенант), по нему же считается dropped."""
+        budget = self.budgets.get(kind)
+        if budget is None:
+            return True
+        now = time.monotonic() if now is None else now
+        bkey = (kind, scope, key)
+        bucket = self._buckets.get(bkey)
+        if bucket is None:
+            bucket = [budget.capacity, now]
+            self._buckets[bkey] = bucket
+            self._evict(now)
+        else:
+            self._buckets.move_to_end(bkey)
+            bucket[0] = min(budget.capacity, bucket[0] + (now - bucket[1]) * budget.rate)
+            bucket[1] = now
+        if bucket[0] >= 1.0:
+            bucket[0] -= 1.0
+            return True
+        self.dropped[(kind, scope)] += 1
+        return False
+
+    def _evict(self, now: float) -> None:
+        # в начале OrderedDict — самые давно тронутые бакеты
+        while self._buckets:
+            (kind, _, _), (_, updated) = next(iter(self._buckets.items()))
+            expired = now - updated > self.budgets[kind].idle_ttl
+            if not expired and len(self._buckets) <= self.max_keys:
+                break
+            self._buckets.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Outer-middleware для dp.message / dp.callback_query: отбрасывает апдейт
+    до фильтров и хэндлеров, т.е. до походов в БД и Bot API.
+    """
+
+    def __init__(self, throttler: Throttler,
+                 valid_codes: Callable[[Dict[str, Any]], FrozenSet[str]],
+                 exempt: Callable[[int], bool] = lambda _: False,
+                 scope: Callable[[Dict[str, Any]], Any] = lambda _: None) -> None:
+        """
+        valid_codes(data) — коды (в нижнем регистре) для этого апдейта;
+        scope(data) — пространство ключей бакетов (например, тенант), чтобы бюджеты не смешивались.
+        """
+        self.throttler = throttler
+        self.valid_codes = valid_codes
+        self.exempt = exempt
+        self.scope = scope
+
+    def classify(self, event: TelegramObject, valid_codes: FrozenSet[str]) -> Optional[str]:
+        if isinstance(event, Message):
+            text = event.text
+            if text and not text.startswith("/"):
+                # верный код тоже не бесплатный: get_chat_member и ensure_user на каждую отправку,
+                # а неподписанный может слать его без конца
+                return "code" if text.strip().lower() in valid_codes else "code_miss"
+        elif isinstance(event, CallbackQuery):
+            data = event.data or ""
+            if data.startswith("subchk:"):
+                return "subchk"
+            if data.startswith("prefs:toggle:"):
+                return "prefs"
+        return None
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        kind = self.classify(event, self.valid_codes(data))
+        user = getattr(event, "from_user", None)
+        if (kind and user and not self.exempt(user.id)
+                and not self.throttler.allow(kind, user.id, scope=self.scope(data))):
+            logger.debug("throttled %s user_id=%s", kind, user.id)
+            return None
+        return await handler(event, data)
@@ -0,0 +1,278 @@
+# tracing.py
+"""
+Лёгкий трейсинг апдейтов: спаны связаны в трейс по update_id.
+
+Решение о сэмплировании принимается один раз на корне трейса (апдейте).
+Вне сэмплированного трейса span() возвращает пустой контекст-менеджер,
+так что под нагрузкой накладные расходы — одно обращение к ContextVar.
+Экспорт идёт из фонового потока: JSONL-файл или OTLP/HTTP (JSON) коллектор.
+"""
+from __future__ import annotations
+
+import abc
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import secrets
+import threading
+import time
+import urllib.request
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+logger = logging.getLogger("prizes-bot.tracing")
+
+_current: ContextVar[Optional["Span"]] = ContextVar("prizes_current_span", default=None)
+
+
+class Span:
+    __slots__ = ("tracer", "trace_id", "span_id", "parent_id", "name", "attrs", "start_ns", "error", "_token")
+
+    def __init__(self, tracer: "Tracer", trace_id: str, parent_id: Optional[str], name: str,
+                 attrs: Dict[str, Any]) -> None:
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.start_ns = 0
+        self.error: Optional[str] = None
+        self._token = None
+
+    def set(self, key: str, value: Any) -> None:
+        self.attrs[key] = value
+
+    def __enter__(self) -> "Span":
+        self.start_ns = time.time_ns()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        end_ns = time.time_ns()
+        _current.reset(self._token)
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        self.tracer.exporter.export({
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": end_ns,
+            "duration_ms": round((end_ns - self.start_ns) / 1e6, 3),
+            "attrs": self.attrs,
+            "error": self.error,
+        })
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+# ---------- ЭКСПОРТЁРЫ ----------
+class _BatchExporter(abc.ABC):
+    """Копит спаны в очереди и отдаёт их пачками из фонового потока; при переполнении — отбрасывает."""
+
+    def __init__(self, max_queue: int = 10_000, batch: int = 256, interval: float = 1.0) -> None:
+        self._q: "queue.Queue[dict]" = queue.Queue(maxsize=max_queue)
+        self._batch = batch
+        self._interval = interval
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+        self._thread.start()
+
+    def export(self, span: dict) -> None:
+        try:
+            self._q.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        while True:
+            items: List[dict] = []
+            deadline = time.monotonic() + self._interval
+            while len(items) < self._batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(self._q.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if not items:
+                continue
+            try:
+                self._write(items)
+            except Exception as e:
+                logger.warning("span export failed (%s spans): %s", len(items), e)
+
+    @abc.abstractmethod
+    def _write(self, spans: List[dict]) -> None:
+        """Отправить пачку спанов; вызывается из фонового потока."""
+
+
+class NullExporter:
+    dropped = 0
+
+    def export(self, span: dict) -> None:
+        pass
+
+
+class JsonlExporter(_BatchExporter):
+    def __init__(self, path: str, **kw: Any) -> None:
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self.path = path
+        super().__init__(**kw)
+
+    def _write(self, spans: List[dict]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(s, ensure_ascii=False, default=str) + "\n" for s in spans))
+
+
+class OtlpHttpExporter(_BatchExporter):
+    """OTLP/HTTP с JSON-кодированием (POST {endpoint}, обычно http://collector:4318/v1/traces)."""
+
+    def __init__(self, endpoint: str, service_name: str = "prizes-bot", **kw: Any) -> None:
+        self.endpoint = endpoint
+        self.service_name = service_name
+        super().__init__(**kw)
+
+    @staticmethod
+    def _attr(k: str, v: Any) -> dict:
+        if isinstance(v, bool):
+            return {"key": k, "value": {"boolValue": v}}
+        if isinstance(v, int):
+            return {"key": k, "value": {"intValue": str(v)}}
+        if isinstance(v, float):
+            return {"key": k, "value": {"doubleValue": v}}
+        return {"key": k, "value": {"stringValue": str(v)}}
+
+    def _write(self, spans: List[dict]) -> None:
+        body = {"resourceSpans": [{
+            "resource": {"attributes": [self._attr("service.name", self.service_name)]},
+            "scopeSpans": [{
+                "scope": {"name": "prizes-bot"},
+                "spans": [{
+                    "traceId": s["trace_id"],
+                    "spanId": s["span_id"],
+                    "parentSpanId": s["parent_id"] or "",
+                    "name": s["name"],
+                    "kind": 1,
+                    "startTimeUnixNano": str(s["start_ns"]),
+                    "endTimeUnixNano": str(s["end_ns"]),
+                    "attributes": [self._attr(k, v) for k, v in s["attrs"].items() if v is not None],
+                    "status": {"code": 2, "message": s["error"]} if s["error"] else {"code": 1},
+                } for s in spans],
+            }],
+        }]}
+        req = urllib.request.Request(self.endpoint, data=json.dumps(body).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"}, method="POST")
+        with urllib.request.urlopen(req, timeout=5) as resp:
+            resp.read()
+
+
+def exporter_from_spec(spec: str):
+    """'' — выключено; 'jsonl:/path/spans.jsonl'; 'otlp:http://host:4318/v1/traces'."""
+    spec = (spec or "").strip()
+    if not spec:
+        return NullExporter()
+    kind, _, target = spec.partition(":")
+    if kind == "jsonl":
+        return JsonlExporter(target)
+    if kind == "otlp":
+        return OtlpHttpExporter(target)
+    raise ValueError(f"unknown TRACE_EXPORT: {spec!r}")
+
+
+# ---------- ТРЕЙСЕР ----------
+class Tracer:
+    def __init__(self, exporter, sample_rate: float = 0.0, max_traces_per_sec: float = 50.0) -> None:
+        self.exporter = exporter
+        self.sample_rate = sample_rate if not isinstance(exporter, NullExporter) else 0.0
+        self.max_traces_per_sec = max_traces_per_sec
+        self._window = 0
+        self._window_count = 0
+
+    def _sampled(self) -> bool:
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return False
+        # жёсткий потолок трейсов в секунду — на случай всплеска
+        sec = int(time.monotonic())
+        if sec != self._window:
+            self._window, self._window_count = sec, 0
+        self._window_count += 1
+        return self._window_count <= self.max_traces_per_sec
+
+    def start_trace(self, name: str, update_id: Optional[int] = None, **attrs: Any):
+        if _current.get() is not None:
+            return self.span(name, update_id=update_id, **attrs)
+        if not self._sampled():
+            return _NOOP
+        trace_id = f"{update_id:032x}" if isinstance(update_id, int) and update_id >= 0 else secrets.token_hex(16)
+        attrs["update_id"] = update_id
+        return Span(self, trace_id, None, name, attrs)
+
+    def span(self, name: str, **attrs: Any):
+        parent = _current.get()
+        if parent is None:
+            return _NOOP
+        return Span(self, parent.trace_id, parent.span_id, name, attrs)
+
+    def traced(self, name: str) -> Callable:
+        def deco(fn: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+            @functools.wraps(fn)
+            async def wrapper(*args: Any, **kwargs: Any) -> Any:
+                if _current.get() is None:
+                    return await fn(*args, **kwargs)
+                with self.span(name):
+                    return await fn(*args, **kwargs)
+            return wrapper
+        return deco
+
+
+# ---------- ИНТЕГРАЦИЯ С AIOGRAM ----------
+class TracingUpdateMiddleware(BaseMiddleware):
+    """dp.update outer-middleware: в вебхуке — дочерний спан, в polling — корень трейса."""
+
+    def __init__(self, tracer: Tracer) -> None:
+        self.tracer = tracer
+
+    async def __call__(self, handler, event, data):
+        with self.tracer.start_trace("dispatch", update_id=getattr(event, "update_id", None),
+                                     event_type=getattr(event, "event_type", None)):
+            return await handler(event, data)
+
+
+class TracingRequestMiddleware(BaseRequestMiddleware):
+    """Спан на каждый вызов Bot API (bot.session.middleware)."""
+
+    def __init__(self, tracer: Tracer) -> None:
+        self.tracer = tracer
+
+    async def __call__(self, make_request, bot, method):
+        if _current.get() is None:
+            return await make_request(bot, method)
+        with self.tracer.span(f"tg.{method.__api_method__}"):
+            return await make_request(bot, method)
@@ -0,0 +1,159 @@
+# workers.py
+"""
+Конкурентная обработка апдейтов — общая для вебхука и polling.
+
+ShardedWorkers: N шардов, у каждого ограниченная очередь и один воркер.
+Апдейты одного пользователя попадают в один шард (по user_id), поэтому
+обрабатываются строго по порядку; разные пользователи — параллельно, не больше
+N одновременно. Заполненная очередь заставляет submit ждать — это обратное
+давление на приём: вебхук отвечает Telegram медленнее, polling не берёт новую пачку.
+Долгие админ-команды (/profile, /archive, выгрузки) уходят из воркера в detach(),
+иначе они держали бы весь шард вместе с чужими пользователями.
+
+poll(): long-polling цикл getUpdates, который отдаёт апдейты в тот же пул.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Set
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramUnauthorizedError
+from aiogram.types import Update
+
+logger = logging.getLogger("prizes-bot.workers")
+
+Job = Callable[[], Awaitable[Any]]
+# on_done(имя задания, длительность в секундах) — например, profiler.record
+OnDone = Callable[[str, float], None]
+
+
+class ShardedWorkers:
+    def __init__(self, shards: int = 64, queue_size: int = 256, on_done: Optional[OnDone] = None) -> None:
+        self.shards = max(1, shards)
+        self.queue_size = max(1, queue_size)
+        self.on_done = on_done
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        self._detached: Set[asyncio.Task] = set()
+        self._rr = 0
+        self.busy = 0
+        self.processed = 0
+        self.failed = 0
+        self.wait_max = 0.0  # максимум ожидания в очереди с прошлого снятия метрик, сек
+
+    # ---------- ЖИЗНЕННЫЙ ЦИКЛ ----------
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._queues = [asyncio.Queue(self.queue_size) for _ in range(self.shards)]
+        self._tasks = [asyncio.create_task(self._worker(q)) for q in self._queues]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Дождаться разбора очередей (не дольше timeout) и остановить воркеры."""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Воркеры: не дождался очередей, брошено апдейтов: %s", self.queued)
+        if self._detached:
+            _, still = await asyncio.wait(set(self._detached), timeout=timeout)
+            if still:
+                logger.warning("Воркеры: отменяю незавершённых фоновых команд: %s", len(still))
+        tasks = self._tasks + list(self._detached)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks, self._queues = [], []
+
+    # ---------- ПРИЁМ ----------
+    async def submit(self, key: Optional[int], job: Job, name: str = "job") -> None:
+        """
+        key — user_id (порядок сохраняется в пределах ключа); None — любой шард.
+        name — под этим именем длительность задания уходит в on_done.
+        """
+        if key is None:
+            self._rr = (self._rr + 1) % self.shards
+            shard = self._rr
+        else:
+            shard = hash(key) % self.shards
+        await self._queues[shard].put((time.monotonic(), name, job))
+
+    def detach(self, coro: Awaitable[Any]) -> None:
+        """Запустить долгую работу отдельной задачей, освободив воркер шарда; stop() её дождётся."""
+        task = asyncio.create_task(self._run_detached(coro))
+        self._detached.add(task)
+        task.add_done_callback(self._detached.discard)
+
+    async def _run_detached(self, coro: Awaitable[Any]) -> None:
+        try:
+            await coro
+        except Exception as e:
+            logger.exception("Ошибка фоновой команды: %s", e)
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            queued_at, name, job = await queue.get()
+            started = time.monotonic()
+            self.wait_max = max(self.wait_max, started - queued_at)
+            self.busy += 1
+            try:
+                await job()
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.exception("Ошибка обработки апдейта: %s", e)
+            finally:
+                self.busy -= 1
+                queue.task_done()
+                if self.on_done is not None:
+                    self.on_done(name, time.monotonic() - started)
+
+    # ---------- МЕТРИКИ ----------
+    @property
+    def detached(self) -> int:
+        return len(self._detached)
+
+    @property
+    def queued(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def take_wait_max(self) -> float:
+        value, self.wait_max = self.wait_max, 0.0
+        return value
+
+
+def update_user_id(update: Update) -> Optional[int]:
+    try:
+        user = getattr(update.event, "from_user", None)
+    except Exception:  # тип апдейта, неизвестный этой версии aiogram
+        return None
+    return user.id if user else None
+
+
+async def poll(bot: Bot, handle: Callable[[Update], Awaitable[None]], *, timeout: int = 30, limit: int = 100,
+               allowed_updates: Optional[List[str]] = None, backoff: tuple = (1.0, 30.0)) -> None:
+    """
+    getUpdates в цикле; handle(update) обычно кладёт апдейт в ShardedWorkers и может ждать места.
+    offset двигается сразу, поэтому каждую пачку Telegram подтверждает следующим запросом.
+    """
+    offset: Optional[int] = None
+    delay = backoff[0]
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, limit=limit, timeout=timeout,
+                                            allowed_updates=allowed_updates, request_timeout=timeout + 10)
+        except TelegramUnauthorizedError:
+            raise
+        except Exception as e:
+            logger.warning("getUpdates bot_id=%s: %s, повтор через %.0fс", bot.id, e, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, backoff[1])
+            continue
+        delay = backoff[0]
+        for update in updates:
+            offset = update.update_id + 1
+            await handle(update)